@@ -1,4 +1,3 @@
-from tkinter import filedialog
 from NexFileHeaders import *
 from NexFileData import *
 from typing import BinaryIO
@@ -0,0 +1,121 @@
+#! /bin/env python
+#
+# Converts many recording folders without the GUI, several at a time.
+#
+#   python batch_convert.py D:\data\mouse1_* D:\data\mouse2_* -j 4
+#   python batch_convert.py @sessions.txt --stream --memory-limit 1024
+#
+# The settings come from OfflineSorter_Helper_Config.json (as saved by the
+# GUI).  Every session logs to Rhd_File_Converter.log and writes the stage
+# profile of the conversion (<output name>_profile.json) in its own folder,
+# and a summary of all sessions is written to batch_summary.csv.
+
+import sys, os, glob, time, traceback
+import argparse
+import csv
+
+from converter_core import CONFIG_FILE, Config, convert, set_handlers
+
+LOG_FILE = 'Rhd_File_Converter.log'
+SUMMARY_FIELDS = ['session', 'status', 'seconds', 'output', 'error']
+
+def find_sessions(patterns):
+    """Expands the given folders and glob patterns into a list of folders, in order and without repeats."""
+    sessions = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if len(matches) == 0:
+            print('No folder matches ' + pattern + ', skipped.')
+        for path in matches:
+            if not os.path.isdir(path):
+                print('Not a folder: ' + path + ', skipped.')
+            elif path not in sessions:
+                sessions.append(path)
+    return sessions
+
+def convert_session(db, config):
+    """Converts one session (in a worker process) and returns its summary row."""
+    errors = []
+    set_handlers(error=errors.append)
+    start = time.time()
+    info = None
+    tmp = sys.stdout
+    with open(os.path.join(db, LOG_FILE), 'a', encoding='utf-8') as log_file:
+        sys.stdout = log_file
+        try:
+            info = convert(db, config)
+        except Exception as e:
+            traceback.print_exc(file=log_file)
+            errors.append(type(e).__name__ + ': ' + str(e))
+        finally:
+            sys.stdout = tmp
+    row = {'session': db, 'status': 'ok' if info is not None else 'failed', 'seconds': round(time.time() - start, 1),
+           'output': os.path.abspath(info['nex_name']) if info is not None else '', 'error': '; '.join(errors)}
+    if info is None and not errors:
+        row['error'] = 'see ' + LOG_FILE
+    return row
+
+def run_batch(sessions, config, jobs):
+    """Converts sessions with up to jobs worker processes; returns the summary rows in session order."""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    # Share the CPUs between the sessions for the per-file decoding.
+    config.workers = max(1, (os.cpu_count() or 1) // jobs)
+    rows = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(convert_session, db, config): db for db in sessions}
+        for future in as_completed(futures):
+            db = futures[future]
+            try:
+                row = future.result()
+            except Exception as e:
+                # The worker itself died (e.g. out of memory).
+                row = {'session': db, 'status': 'failed', 'seconds': '', 'output': '', 'error': type(e).__name__ + ': ' + str(e)}
+            rows[db] = row
+            print('[%d/%d] %-6s %s %s' % (len(rows), len(sessions), row['status'], db, row['error'] or '(%s s)' % row['seconds']))
+    return [rows[db] for db in sessions]
+
+def write_summary(rows, filename):
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Converts rhd recording folders to nex/nex5 files in parallel.', fromfile_prefix_chars='@')
+    parser.add_argument('sessions', nargs='+', help='session folders or glob patterns; @file reads them from a file, one per line')
+    parser.add_argument('-c', '--config', default=os.path.join(os.getcwd(), CONFIG_FILE), help='settings saved by the GUI (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=2, help='sessions converted at the same time (default: %(default)s)')
+    parser.add_argument('-o', '--file-name', default='out', help='output file name in every session folder (default: %(default)s)')
+    parser.add_argument('--stream', action='store_true', help='bounded-memory streaming conversion')
+    parser.add_argument('--memory-limit', type=int, help='memory limit per session for --stream, in MB')
+    parser.add_argument('--trace-memory', action='store_true', help='record the peak allocated memory of every stage in the profile (slow)')
+    parser.add_argument('--summary', default='batch_summary.csv', help='summary file (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.config):
+        parser.error('config file not found: ' + args.config)
+    config = Config.load(args.config)
+    config.file_name = args.file_name
+    if args.stream:
+        config.stream_en = 1
+    if args.memory_limit is not None:
+        config.memory_limit = args.memory_limit
+    config.trace_memory = int(args.trace_memory)
+    sessions = find_sessions(args.sessions)
+    if len(sessions) == 0:
+        parser.error('no session folders found')
+    jobs = max(1, min(args.jobs, len(sessions)))
+
+    print('Converting %d sessions, %d at a time.' % (len(sessions), jobs))
+    start = time.time()
+    rows = run_batch(sessions, config, jobs)
+    write_summary(rows, args.summary)
+    failed = sum(row['status'] != 'ok' for row in rows)
+    print('%d converted, %d failed in %.0f s. Summary: %s' % (len(rows) - failed, failed, time.time() - start, os.path.abspath(args.summary)))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
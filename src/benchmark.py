@@ -0,0 +1,252 @@
+#! /bin/env python
+#
+# Times the readers and the conversion steps on synthetic recordings of
+# several sizes, and compares the times with a saved baseline.
+#
+#   python benchmark.py --save baseline.json
+#   python benchmark.py --compare baseline.json --sizes 32x5,128x20
+#
+# Every size is a session of --files rhd files (channels x seconds per file)
+# written by synthetic_rhd.  Each step is run --repeat times on the same
+# input; the best time counts, and throughput is given in MB of recording
+# data (as stored in the rhd files) per second.
+
+import sys, os, time, json, shutil, tempfile, platform
+import argparse
+import contextlib
+from statistics import median
+
+import numpy as np
+
+import converter_core as core
+from converter_core import Config
+from synthetic_rhd import write_session
+
+DEFAULT_SIZES = '32x5,64x5,128x5'
+
+def make_session(folder, channels, seconds, files):
+    """Writes (or reuses) the synthetic session in folder; returns its benchmark state."""
+    paths = sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.rhd')) if os.path.isdir(folder) else []
+    if len(paths) != files:
+        shutil.rmtree(folder, ignore_errors=True)
+        paths = write_session(folder, files, seconds, num_channels=channels, num_dig_in=2, num_dig_out=1, gaps=[100])
+    info = Config(ref_en=1, workers=1, file_name='benchmark').info(folder)
+    file_list = core.get_rhds(info)
+    info['recording_bytes'] = sum(core.scan_bytes(scan) for scan in info['rhd_scan'])
+    return {'paths': [f[0] for f in file_list], 'file_list': file_list, 'info': info,
+            'channels': channels, 'seconds': seconds}
+
+def decoded(session):
+    """data_list and info after decode_rhds and motion_detect, decoded once per session."""
+    if 'decoded' not in session:
+        info = dict(session['info'])
+        data_list = core.decode_rhds(session['file_list'], info)
+        core.motion_detect(info)
+        session['decoded'] = (data_list, info)
+    return session['decoded']
+
+def merged(session):
+    """data and info after data_merge and imp_decode, once per session."""
+    if 'merged' not in session:
+        data_list, info = decoded(session)
+        info = dict(info)
+        data = core.data_merge(list(data_list), info)
+        data = core.imp_decode(data, info)
+        session['merged'] = (data, info)
+    return session['merged']
+
+def file_data(session):
+    """FileData of the output, with every channel as save_nex builds it."""
+    from NexFileData import Continuous
+    data, info = merged(session)
+    fd = core.nex_file_data(info, data.shape[1])
+    for i, c_name in enumerate(core.channel_names(info)):
+        fd.Continuous.append(Continuous(c_name, info['sample_rate'], info['frag_ticks']/info['sample_rate'], info['frag_starts'], data[i].tolist()))
+    return fd
+
+# Every benchmark takes the session and returns (setup, run): setup() is
+# untimed and returns the arguments of run(), which is timed.
+
+def bench_read_data(session):
+    from load_intan_rhd_format import read_data
+    def run():
+        for path in session['paths']:
+            read_data(path)
+    return None, run
+
+def bench_read_data_raw(session):
+    return None, lambda: [core.decode_rhd(path) for path in session['paths']]
+
+def bench_rhd_file(session):
+    from rhd_file import RhdFile
+    def run():
+        for path in session['paths']:
+            with RhdFile(path) as f:
+                f.amplifier_data[:, :]
+    return None, run
+
+def bench_data_block_reader(session):
+    from load_intan_rhd_format import DataBlockReader
+    def run():
+        for path in session['paths']:
+            reader = DataBlockReader(path)
+            try:
+                for blocks in reader.blocks(1024, signal_types=['amplifier']):
+                    pass
+            finally:
+                reader.close()
+    return None, run
+
+def bench_decode_rhds(session):
+    return lambda: (dict(session['info']),), lambda info: core.decode_rhds(session['file_list'], info)
+
+def bench_data_merge(session):
+    data_list, info = decoded(session)
+    return lambda: (list(data_list), dict(info)), core.data_merge
+
+def bench_ref(mode):
+    def bench(session):
+        data, info = merged(session)
+        info = dict(info, ref_mode=mode)
+        return lambda: (data.copy(), info), core.ref_process
+    return bench
+
+def bench_writer(nex5):
+    def bench(session):
+        import NexFileWriters
+        name = merged(session)[1]['file_name'] + ('.nex5' if nex5 else '.nex')
+        if nex5:
+            run = lambda fd: NexFileWriters.Nex5FileWriter().WriteDataToNex5File(fd, name)
+        else:
+            run = lambda fd: NexFileWriters.NexFileWriter().WriteDataToNexFile(fd, name)
+        return lambda: (file_data(session),), run
+    return bench
+
+def bench_save_nex(session):
+    data, info = merged(session)
+    return lambda: (data, dict(info, file_format=1)), core.save_nex
+
+def bench_stream(session):
+    def run(info):
+        core.stream_scan(session['file_list'], info)
+        core.imp_check(info)
+        core.stream_save(session['file_list'], info)
+    return lambda: (dict(session['info'], stream_en=1, file_format=1),), run
+
+BENCHMARKS = [
+    ('read_data', bench_read_data),
+    ('read_data_raw', bench_read_data_raw),
+    ('rhd_file', bench_rhd_file),
+    ('data_block_reader', bench_data_block_reader),
+    ('decode_rhds', bench_decode_rhds),
+    ('data_merge', bench_data_merge),
+    ('ref_process_mean', bench_ref('mean')),
+    ('ref_process_median', bench_ref('median')),
+    ('ref_process_pca', bench_ref('pca')),
+    ('nex_writer', bench_writer(False)),
+    ('nex5_writer', bench_writer(True)),
+    ('save_nex5', bench_save_nex),
+    ('stream_save_nex5', bench_stream),
+]
+
+def time_benchmark(bench, session, repeat):
+    """Seconds of each of repeat runs of bench on session."""
+    setup, run = bench(session)
+    times = []
+    for r in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+        del args
+    return times
+
+def environment():
+    return {'python': sys.version.split()[0], 'numpy': np.__version__, 'platform': sys.platform,
+            'machine': platform.machine(), 'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+
+def run_benchmarks(sizes, files, repeat, names, data_dir):
+    """Runs the named benchmarks on a session of every size; returns the results dict."""
+    results = []
+    for channels, seconds in sizes:
+        size = '%dx%d' % (channels, seconds)
+        print('Session %s: %d files of %d channels x %d s' % (size, files, channels, seconds))
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            session = make_session(os.path.join(data_dir, '%s_%d' % (size, files)), channels, seconds, files)
+        data_bytes = session['info']['recording_bytes']
+        for name, bench in BENCHMARKS:
+            if names and name not in names:
+                continue
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                times = time_benchmark(bench, session, repeat)
+            best = min(times)
+            results.append({'name': name, 'size': size, 'channels': channels, 'seconds': seconds, 'files': files,
+                            'data_bytes': data_bytes, 'times': [round(t, 4) for t in times], 'best': round(best, 4),
+                            'median': round(median(times), 4), 'mb_per_s': round(data_bytes / best / 1e6, 1)})
+            print('  %-20s best %8.3f s  median %8.3f s  %8.1f MB/s' % (name, best, median(times), data_bytes / best / 1e6))
+    return {'created': time.strftime('%Y-%m-%d %X', time.localtime()), 'repeat': repeat,
+            'environment': environment(), 'results': results}
+
+def compare(report, baseline, tolerance):
+    """Prints the change of every best time against baseline; returns the number of regressions."""
+    if baseline['environment'] != report['environment']:
+        print('Note: the baseline was run in another environment: ' + json.dumps(baseline['environment']))
+    old = {(r['name'], r['size'], r['files']): r for r in baseline['results']}
+    regressions = 0
+    print('%-20s %-8s %10s %10s %8s' % ('benchmark', 'size', 'baseline', 'now', 'change'))
+    for result in report['results']:
+        base = old.get((result['name'], result['size'], result['files']))
+        if base is None:
+            print('%-20s %-8s %10s %10.3f %8s' % (result['name'], result['size'], '-', result['best'], 'new'))
+            continue
+        ratio = result['best'] / base['best'] if base['best'] > 0 else 1.0
+        verdict = ''
+        if ratio > 1 + tolerance:
+            verdict = 'slower'
+            regressions += 1
+        elif ratio < 1 - tolerance:
+            verdict = 'faster'
+        print('%-20s %-8s %10.3f %10.3f %+7.1f%% %s' % (result['name'], result['size'], base['best'], result['best'], (ratio - 1) * 100, verdict))
+    return regressions
+
+def parse_sizes(text):
+    sizes = []
+    for size in text.split(','):
+        channels, seconds = size.lower().split('x')
+        sizes.append((int(channels), int(seconds)))
+    return sizes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the rhd readers and the conversion steps on synthetic recordings.')
+    parser.add_argument('--sizes', type=parse_sizes, default=parse_sizes(DEFAULT_SIZES), help='channels x seconds per file, comma separated (default: %s)' % DEFAULT_SIZES)
+    parser.add_argument('--files', type=int, default=2, help='rhd files per session (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs of every benchmark (default: %(default)s)')
+    parser.add_argument('-b', '--benchmarks', nargs='+', choices=[name for name, bench in BENCHMARKS], help='benchmarks to run (default: all)')
+    parser.add_argument('--data', help='folder for the synthetic sessions, kept for later runs (default: a temporary folder)')
+    parser.add_argument('-s', '--save', help='write the results to this JSON file')
+    parser.add_argument('-c', '--compare', help='compare with the results saved in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative change taken as noise (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    data_dir = args.data or tempfile.mkdtemp(prefix='rhd_benchmark_')
+    try:
+        report = run_benchmarks(args.sizes, args.files, args.repeat, args.benchmarks, data_dir)
+    finally:
+        if not args.data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        print('Results saved to ' + os.path.abspath(args.save))
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        print('%d slower than the baseline.' % regressions)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+#! /bin/env python
+#
+# Common (average / median) referencing of multichannel data, per channel group.
+
+import re
+import numpy as np
+
+CHANNEL_GROUPS_FILE = 'channel_groups.txt'
+CHUNK_BYTES = 32 * 1024 * 1024
+
+def read_channel_groups(filename):
+    """Reads a channel-map file with one reference group per line.
+
+    Each line lists channel numbers (as in the output names ch0, ch1, ...)
+    separated by commas or spaces; a-b stands for the range a to b.  Text
+    after '#' is a comment, and an optional 'name:' prefix labels the group.
+    Returns a list of (name, channels) tuples.
+    """
+
+    groups = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            name = 'group' + str(len(groups))
+            if ':' in line:
+                name, line = line.split(':', 1)
+                name = name.strip()
+            channels = []
+            for token in re.split(r'[,\s]+', line.strip()):
+                if not token:
+                    continue
+                reobj = re.search(r'^(?P<start>\d+)-(?P<end>\d+)$', token)
+                if reobj:
+                    channels += list(range(int(reobj.group('start')), int(reobj.group('end')) + 1))
+                elif token.isdigit():
+                    channels.append(int(token))
+                else:
+                    raise Exception('Invalid channel in ' + filename + ': ' + token)
+            groups.append((name, channels))
+    return groups
+
+def group_rows(channels, groups):
+    """Maps channel groups onto data rows.
+
+    channels gives the channel number of every row of the data; groups is a
+    list of (name, channels) as returned by read_channel_groups.  Rows not in
+    any group form a last group named 'rest'.  Returns a list of
+    (name, rows) tuples, rows being a slice when the group is contiguous.
+    """
+
+    row_of = {c: i for i, c in enumerate(channels)}
+    used = set()
+    result = []
+    for name, group in groups:
+        rows = sorted(set(row_of[c] for c in group if c in row_of) - used)
+        used.update(rows)
+        result.append((name, rows))
+    rest = [i for i in range(len(channels)) if i not in used]
+    if rest:
+        result.append(('rest', rest))
+    return [(name, as_slice(rows)) for name, rows in result if len(rows)]
+
+def as_slice(rows):
+    """Returns rows as a slice if they are consecutive, so they can be used as a view."""
+    if len(rows) and rows[-1] - rows[0] == len(rows) - 1:
+        return slice(rows[0], rows[-1] + 1)
+    return rows
+
+def reference_chunk(num_channels, itemsize=8, chunk_bytes=CHUNK_BYTES):
+    """Number of samples common_reference processes at a time."""
+    return max(1024, int(chunk_bytes // (max(num_channels, 1) * itemsize)))
+
+def pick_chunks(num_samples, chunk_samples, num_chunks=32):
+    """Indexes of the (up to num_chunks) chunks estimate_components uses, on a fixed grid."""
+    total_chunks = -(-num_samples // chunk_samples)
+    return np.unique(np.round(np.linspace(0, total_chunks - 1, min(total_chunks, num_chunks))).astype(int))
+
+class ComponentEstimator:
+    """Channel covariance of a group, accumulated chunk by chunk.
+
+    Per-chunk means and scatter matrices are merged as chunks are added, so
+    memory depends only on the number of channels.
+    """
+
+    def __init__(self):
+        self.mean = None
+        self.scatter = None
+        self.count = 0
+
+    def add(self, sub):
+        n = sub.shape[1]
+        chunk_mean = sub.mean(axis=1)
+        centered = sub - chunk_mean[:, None]
+        if self.mean is None:
+            self.mean = chunk_mean
+            self.scatter = centered @ centered.T
+        else:
+            delta = chunk_mean - self.mean
+            self.scatter += centered @ centered.T + np.outer(delta, delta) * (self.count * n / (self.count + n))
+            self.mean = self.mean + delta * (n / (self.count + n))
+        self.count += n
+
+    def components(self, num_components):
+        """(basis, mean): the num_components leading eigenvectors as columns, and the channel means.
+
+        The eigenvectors are those of the mean-centred covariance, so they
+        are to be applied to data with mean taken off (see common_reference).
+        num_components is clamped to 1..channels-1, so at least one
+        dimension of the signal is always kept.
+        """
+        eigenvalues, eigenvectors = np.linalg.eigh(self.scatter / self.count)
+        num_components = max(1, min(int(num_components), eigenvectors.shape[0] - 1))
+        return eigenvectors[:, ::-1][:, :num_components], self.mean
+
+def estimate_components(data, rows, num_components, chunk_samples, num_chunks=32):
+    """Estimates the main components shared by the channels rows of data.
+
+    The channel covariance is accumulated chunk by chunk (see
+    ComponentEstimator) over up to num_chunks chunks of chunk_samples
+    samples, evenly spread over the recording on a fixed grid (pick_chunks).
+    Memory does not depend on the recording length.  Returns the
+    num_components leading eigenvectors as the columns of a matrix, with
+    the channel means they were estimated around (see
+    ComponentEstimator.components).
+    """
+
+    estimator = ComponentEstimator()
+    for c in pick_chunks(data.shape[1], chunk_samples, num_chunks):
+        estimator.add(data[rows, c * chunk_samples:(c + 1) * chunk_samples])
+    return estimator.components(num_components)
+
+def group_size(rows, num_channels):
+    return len(range(num_channels)[rows]) if isinstance(rows, slice) else len(rows)
+
+def common_reference(data, groups=None, mode='mean', chunk_bytes=CHUNK_BYTES, num_components=3, components=None):
+    """Subtracts a common reference from data (channels x samples) in place.
+
+    groups is a list of row selections (slices or index lists); every group
+    is referenced to its own mean or median ('mode') across channels.  By
+    default all rows form one group.  The data are processed in time chunks
+    of about chunk_bytes, so the only temporaries are one chunk's reference
+    (and, for non-contiguous groups or the median, one chunk of the group).
+
+    With mode 'pca', the num_components leading components shared by the
+    channels of a group (see estimate_components) are regressed out instead;
+    this takes one extra pass over a subsample of the chunks, unless the
+    (basis, mean) components of every group are given (e.g. estimated while
+    streaming).  The components come from the mean-centred covariance, so
+    the channel means are taken off before projecting and kept: per-channel
+    offsets are left in the data, not removed with the components.
+    """
+
+    if mode not in ('mean', 'median', 'pca'):
+        raise Exception('Unknown reference mode: ' + str(mode))
+    if groups is None:
+        groups = [slice(None)]
+    num_channels, num_samples = data.shape
+    chunk = reference_chunk(num_channels, data.itemsize, chunk_bytes)
+    if num_samples == 0:
+        return data
+
+    if mode == 'pca' and components is None:
+        components = [estimate_components(data, rows, min(num_components, group_size(rows, num_channels) - 1), chunk)
+                      for rows in groups]
+
+    for start in range(0, num_samples, chunk):
+        block = data[:, start:start + chunk]
+        for g, rows in enumerate(groups):
+            sub = block[rows]
+            if mode == 'mean':
+                ref = sub.mean(axis=0)
+            elif mode == 'median':
+                ref = np.median(sub, axis=0)
+            else:
+                basis, mean = components[g]
+                ref = basis @ (basis.T @ (sub - mean[:, None]))
+            if isinstance(rows, slice):
+                sub -= ref
+            else:
+                block[rows] = sub - ref
+    return data
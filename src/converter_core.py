@@ -0,0 +1,1077 @@
+#! /bin/env python
+#
+# Conversion pipeline of OfflineSorter Helper, without the GUI.
+#
+# convert() turns one recording folder into a .nex/.nex5 file (and the
+# OfflineSorter scripts) from a Config.  Errors and progress go to the
+# handlers set with set_handlers(); by default they are only logged.
+# Progress is counted in bytes: every pass over the data counts the size of
+# the recording, and the handler is given the total over the number of
+# passes, in bytes of the recording.  A conversion can be cancelled between chunks.
+# numpy is imported on first use, so importing this module is fast.
+
+import sys, os, re, json
+import importlib.util
+from csv import DictReader
+from functools import partial
+from time import mktime, strptime, strftime, localtime
+
+def lazy_import(name):
+    """Returns module name, to be loaded when one of its attributes is first used."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or not hasattr(spec.loader, 'exec_module'):
+        return importlib.import_module(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+np = lazy_import('numpy')
+
+CONFIG_FILE = 'OfflineSorter_Helper_Config.json'
+
+handlers = {'error': None, 'progress': None, 'cancel': None}
+progress = {'done': 0, 'total': 0, 'passes': 1}
+
+class Cancelled(Exception):
+    """Raised at the next progress step when the cancel handler returns True."""
+
+def set_handlers(error=None, progress=None, cancel=None):
+    """Sets the functions that show an error message, show the progress and ask whether to stop.
+
+    progress is called as progress(done, total): total is the size of the
+    recording in bytes and done how much of it has been got through (the
+    bytes processed over all passes, divided by the number of passes), so
+    done over the time taken is the throughput of the input.  cancel is
+    called without arguments at every progress step and returns True to
+    stop.
+    """
+    handlers['error'] = error
+    handlers['progress'] = progress
+    handlers['cancel'] = cancel
+
+def report_error(message):
+    if handlers['error'] is None:
+        save_log("Error: "+message)
+    else:
+        handlers['error'](message)
+
+def start_progress(recording_bytes, passes=1):
+    """Starts counting passes passes over a recording of recording_bytes."""
+    progress['done'] = 0
+    progress['total'] = passes * recording_bytes
+    progress['passes'] = passes
+    add_progress(0)
+
+def report_progress():
+    if handlers['progress'] is not None:
+        handlers['progress'](progress['done'] / progress['passes'], progress['total'] / progress['passes'])
+
+def add_progress(nbytes):
+    """Counts nbytes more of the work done; raises Cancelled if asked to stop."""
+    if handlers['cancel'] is not None and handlers['cancel']():
+        raise Cancelled()
+    progress['done'] += nbytes
+    report_progress()
+
+def finish_progress():
+    progress['done'] = progress['total']
+    report_progress()
+
+def save_log(s):
+    t = strftime('%Y-%m-%d %X', localtime())
+    print ('%s--%s'%(t,s))
+
+def get_rhds(info):
+    from intan_dat_file import is_dat_folder, scan_dat_folder
+    from intanutil.rhd_index import load_index
+    if is_dat_folder(info['db']):
+        # One file per signal type: the whole folder is a single recording.
+        info['rhd_scan'] = [scan_dat_folder(info['db'])]
+        if len(info['rhd_scan'][0]['gaps']):
+            save_log("Found "+str(len(info['rhd_scan'][0]['gaps']))+" timestamp gaps in dat files.")
+        save_log("Get one-file-per-signal-type recording (info.rhd). Start parsing data.\n")
+        return [(info['db'], 0)]
+    files = os.listdir(info['db'])
+    file_list = []
+    for file in files:
+        reobj = re.search(r'.*_(?P<year>\d{2})(?P<month>\d{2})(?P<date>\d{2})_(?P<hour>\d{2})(?P<minute>\d{2})(?P<second>\d{2})\.rhd(\.gz|\.bz2|\.xz)?$', file, re.IGNORECASE)
+        if reobj:
+            td = reobj.groupdict()
+            ts = "20"+td["year"]+" "+td["month"]+" "+td["date"]+" "+td["hour"]+" "+td["minute"]+" "+td["second"]
+            timestamp = mktime(strptime(ts,"%Y %m %d %H %M %S")) 
+            file_list.append((os.path.join(info['db'], file), timestamp))
+    file_list.sort(key=lambda x:x[1])
+    if len(file_list)==0:
+        report_error("输入文件夹中没有rhd文件")
+        return []
+    elif len(file_list)>1:
+        len_per_file = file_list[1][1] - file_list[0][1]
+        for i in range(len(file_list)-1):
+            if not file_list[i+1][1] - file_list[i][1] == len_per_file:
+                report_error("输入文件夹包含非连续记录的多个rhd文件")
+                return []
+    info['rhd_scan'] = [load_index(f[0]) for f in file_list]
+    if len(set(s['sample_rate'] for s in info['rhd_scan'])) > 1:
+        report_error("rhd文件的采样率不同")
+        return []
+    gaps = sum(len(s['gaps']) for s in info['rhd_scan'])
+    for prev, cur in zip(info['rhd_scan'][:-1], info['rhd_scan'][1:]):
+        if prev['last_timestamp'] is not None and cur['first_timestamp'] is not None and cur['first_timestamp'] != prev['last_timestamp'] + 1:
+            gaps += 1
+    if gaps:
+        save_log("Found "+str(gaps)+" timestamp gaps in rhd files.")
+    save_log("Get "+str(len(file_list))+" rhd files in total. Start parsing data.\n" )
+    return file_list
+
+def scan_bytes(scan):
+    """Size of the data of a scanned rhd file or dat folder, as stored in an uncompressed rhd file."""
+    from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
+    header = scan['header']
+    return int(scan['num_samples'] * get_bytes_per_data_block(header) / header['num_samples_per_data_block'])
+
+def decode_rhd(file_path, signal_types=('amplifier', 'board_dig_in', 'board_dig_out')):
+    """Decodes the amplifier data of one rhd file (or dat folder) as raw counts; runs in a worker process."""
+    from load_intan_rhd_format import read_data
+    from intan_dat_file import read_dat_data
+    if os.path.isdir(file_path):
+        return read_dat_data(file_path, raw=True)
+    return read_data(file_path, signal_types=list(signal_types), raw=True)
+
+def map_in_order(func, items, workers):
+    """Yields func(item) for every item, in order, using up to workers processes."""
+    from concurrent.futures import ProcessPoolExecutor
+    if workers <= 1 or len(items) <= 1:
+        yield from map(func, items)
+        return
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(items)))
+    try:
+        yield from pool.map(func, items)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def decode_rhds(file_list, info):
+    from intanutil.notch_filter import notch_filter_chunk
+    data_list = []
+    total_time = 0
+    sample_rate_list = []
+    port_list = []
+    work_ch = []
+    imp = []
+    notch_state = None
+    timestamps = []
+    aux_data = []
+    dig_words = {'board_dig_in': [], 'board_dig_out': []}
+    dig_channels = {'board_dig_in': [], 'board_dig_out': []}
+    file_paths = [f[0] for f in file_list]
+    decode = decode_rhd
+    if info['motion_en']:
+        decode = partial(decode_rhd, signal_types=('amplifier', 'aux_input', 'board_dig_in', 'board_dig_out'))
+    for i, (data, record_time, sample_rate) in enumerate(map_in_order(decode, file_paths, info['workers'])):
+        file_path = file_paths[i]
+        save_log("Parsed data from "+file_path)
+        if not len(port_list):
+            for ch_info in data['amplifier_channels']:
+                port_list.append(ch_info['port_prefix'])
+                work_ch.append(ch_info['native_order'])
+                imp.append(ch_info['electrode_impedance_magnitude'])
+            work_ch.sort()
+            if len(set(port_list)) > 1:
+                report_error("当前版本暂不支持记录多个port的rhd文件")
+                return []
+        sample_rate_list.append(sample_rate)
+        total_time += record_time
+        if not 'amplifier_data' in data:
+            data_list.append(np.zeros((len(work_ch), 0)))
+            timestamps.append(np.zeros(0, dtype=np.int64))
+            aux_data.append(None)
+            for dig in dig_words:
+                dig_words[dig].append(np.zeros(0, dtype=np.uint16))
+            continue
+
+        # Sample timestamps, to find gaps across the whole session.
+        timestamps.append(np.round(data['t_amplifier']*sample_rate).astype(np.int64))
+
+        # Accelerometer data, for motion detection.
+        aux_data.append(data.get('aux_input_data'))
+
+        # Keep the packed digital words; events are extracted when saving.
+        for dig in dig_words:
+            if dig+'_raw' in data:
+                dig_words[dig].append(data[dig+'_raw'])
+                dig_channels[dig] = data[dig+'_channels']
+            else:
+                dig_words[dig].append(np.zeros(data['amplifier_data'].shape[1], dtype=np.uint16))
+
+        # Scale counts to mV; the notch filter state runs on across files.
+        amplifier_data = data['amplifier_data'].astype(np.float64, order='C')
+        amplifier_data *= data['amplifier_scale']
+        if data['amplifier_notch_frequency'] > 0:
+            amplifier_data, notch_state = notch_filter_chunk(amplifier_data, sample_rate, data['amplifier_notch_frequency'], 10, notch_state,
+                                                             block_size=info['rhd_scan'][i]['header']['num_samples_per_data_block'])
+        else:
+            notch_state = None
+        data_list.append(amplifier_data)
+        add_progress(scan_bytes(info['rhd_scan'][i]))
+    if len(set(sample_rate_list)) > 1:
+        report_error("rhd文件的采样率不同")
+        return []
+    print("")
+    save_log("Parsing complete. Get "+str(total_time)+" seconds data in total with sample rate of "+str(sample_rate_list[0]/1000)+" kHz.\n")
+    info['imp'] = imp
+    info['sample_rate'] = sample_rate_list[0]
+    info['work_ch'] = work_ch
+    info['timestamps'] = timestamps
+    info['aux_data'] = aux_data
+    info['dig_words'] = dig_words
+    info['dig_channels'] = dig_channels
+    return data_list
+
+def motion_detect(info):
+    """Flags high-motion periods from the headstage accelerometer (aux inputs).
+
+    The periods are cropped like manually entered noise segments, or kept in
+    the data and marked as a 'motion' Interval in the nex file.
+    """
+    from intanutil.motion_detection import detect_motion
+    info['motion_list'] = []
+    aux_data = info.pop('aux_data', [])
+    if not info['motion_en']:
+        return
+    if len(aux_data) == 0 or any(aux is None for aux in aux_data):
+        save_log("No aux input channels recorded, motion detection skipped.")
+        return
+    aux = np.concatenate(aux_data, axis=1)
+    add_motion_periods(info, detect_motion(aux, info['sample_rate']/4, threshold=info['motion_threshold']))
+
+def add_motion_periods(info, periods):
+    """Crops or marks the detected motion periods, as set by info['motion_mode']."""
+    save_log("Found "+str(len(periods))+" motion periods, "+str(sum(end-start for start, end in periods))+" seconds in total.")
+    if info['motion_mode'] == 0:
+        info['delete_list'] += periods
+    else:
+        info['motion_list'] = periods
+
+def data_merge(data_list, info):
+    from intanutil.digital_channels import get_word_runs
+    ch = data_list[0].shape[0]
+    length = sum(d.shape[1] for d in data_list)
+    kept_ranges = crop_timeline(info, timestamp_steps(info.pop('timestamps')), length)
+
+    # Size the output once and slice each file's kept ranges into place,
+    # releasing the per-file arrays on the way.
+    data = np.empty((ch, sum(end-start for start, end in kept_ranges)), dtype=np.result_type(*data_list))
+    pos = 0
+    file_start = 0
+    k = 0
+    while len(data_list)>0:
+        n = data_list[0].shape[1]
+        for start, end in kept_ranges:
+            start = max(start, file_start)
+            end = min(end, file_start+n)
+            if end > start:
+                data[:, pos:pos+end-start] = data_list[0][:, start-file_start:end-file_start]
+                pos += end-start
+        file_start += n
+        del data_list[0]
+        add_progress(scan_bytes(info['rhd_scan'][k]))
+        k += 1
+    info['dig_runs'] = {}
+    for dig, words in info.pop('dig_words').items():
+        info['dig_runs'][dig] = crop_runs(get_word_runs(np.concatenate(words)), kept_ranges)
+    return data
+
+def crop_timeline(info, steps, length):
+    """Applies info['delete_list'] to a recording of length samples.
+
+    steps are the timestamp steps of the recording (see timestamp_steps).
+    Sets the fragments ('frag_starts', 'frag_ticks'), the removed segments
+    ('removed_spans', in seconds) and the motion periods to mark
+    ('motion_marks', in saved-data sample indexes) of the saved data, and
+    returns the kept (start, end) sample ranges.
+    """
+
+    from interval_set import IntervalSet
+    sample_rate = info['sample_rate']
+    crop = IntervalSet(info['delete_list'])
+    kept_ranges = crop.complement_ranges(sample_rate, length)
+    if info['crop_mode'] == 0:
+        # Spliced segments close up, so only real recording gaps remain.
+        info['frag_starts'], info['frag_ticks'] = find_fragments(steps, kept_ranges)
+        info['removed_spans'] = []
+    else:
+        # Removed segments become gaps: kept samples keep their true times,
+        # counted from the first sample of the recording.
+        full = {'sample_rate': sample_rate}
+        full['frag_starts'], full['frag_ticks'] = find_fragments(steps, [(0, length)])
+        info['frag_starts'], info['frag_ticks'] = find_fragments(steps, kept_ranges, splice=False)
+        if len(kept_ranges):
+            info['frag_ticks'] += int(round(sample_times(kept_ranges[0][0], full)*sample_rate))
+        info['removed_spans'] = [(sample_times(start, full), sample_times(end-1, full) + 1/sample_rate)
+                                 for start, end in crop.sample_ranges(sample_rate, length)]
+    if len(info['frag_starts']) > 1:
+        save_log("Data saved as "+str(len(info['frag_starts']))+" fragments because of timestamp gaps or removed segments.")
+
+    # Motion periods marked rather than cropped, in saved-data sample indexes.
+    offsets = np.cumsum([0] + [end-start for start, end in kept_ranges])
+    info['motion_marks'] = []
+    for start, end in IntervalSet(info['motion_list']).sample_ranges(sample_rate, length):
+        marks = [(offsets[k]+max(s, start)-s, offsets[k]+min(e, end)-1-s) for k, (s, e) in enumerate(kept_ranges) if s < end and e > start]
+        if len(marks):
+            info['motion_marks'].append((marks[0][0], marks[-1][1]))
+    return kept_ranges
+
+def timestamp_steps(timestamps):
+    """Positions and sizes of the timestamp steps other than one sample.
+
+    timestamps is the list of per-file sample timestamp arrays of a
+    recording.  Returns (positions, jumps): the sample index after every
+    such step and the step in samples.
+    """
+    timestamps = np.concatenate(timestamps)
+    steps = np.diff(timestamps)
+    jumps = np.flatnonzero(steps != 1)
+    return jumps + 1, steps[jumps]
+
+def scan_steps(scans):
+    """timestamp_steps from the file indexes (rhd_scan), without reading the data."""
+    positions = []
+    jumps = []
+    file_start = 0
+    last_timestamp = None
+    for scan in scans:
+        if scan['num_samples'] > 0:
+            if last_timestamp is not None and scan['first_timestamp'] != last_timestamp + 1:
+                positions.append(file_start)
+                jumps.append(scan['first_timestamp'] - last_timestamp)
+            for index, jump in scan['gaps']:
+                positions.append(file_start + index)
+                jumps.append(jump)
+            last_timestamp = scan['last_timestamp']
+        file_start += scan['num_samples']
+    return np.array(positions, dtype=np.int64), np.array(jumps, dtype=np.int64)
+
+def find_fragments(steps, ranges, splice=True):
+    """Splits the kept sample ranges of a recording into continuous fragments.
+
+    steps are the timestamp steps of the recording (see timestamp_steps) and
+    ranges the kept (start, end) sample ranges.  A forward jump of more than
+    one sample between consecutive kept samples starts a new fragment; with
+    splice, the samples removed between two ranges do not count (the ranges
+    close up).  Backward jumps cannot be represented and are treated as
+    continuous.  Returns the index in the kept data and the time (in
+    samples, relative to the first kept sample) at which each fragment starts.
+    """
+
+    positions, jumps = steps
+    # Timestamp minus sample index, before the first step and after each step.
+    drift = np.concatenate(([0], np.cumsum(jumps - 1)))
+    index = []
+    step = []
+    kept = 0
+    prev_end = None
+    for start, end in ranges:
+        if prev_end is not None:
+            jump = 1 + drift[np.searchsorted(positions, start, side='right')] - drift[np.searchsorted(positions, prev_end-1, side='right')]
+            if not splice:
+                jump += start - prev_end
+            index.append([kept])
+            step.append([jump])
+        first = np.searchsorted(positions, start, side='right')
+        last = np.searchsorted(positions, end, side='left')
+        index.append(kept + positions[first:last] - start)
+        step.append(jumps[first:last])
+        kept += end - start
+        prev_end = end
+    index = np.concatenate(index + [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+    step = np.concatenate(step + [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+    gaps = step > 1
+    starts = np.concatenate(([0], index[gaps]))
+    ticks = starts + np.concatenate(([0], np.cumsum(step[gaps] - 1)))
+    return starts, ticks
+
+def crop_runs(runs, ranges):
+    """Runs of digital words (see get_word_runs) left after keeping only the given sample ranges."""
+    starts, values = runs
+    index = [np.zeros(0, dtype=np.int64)]
+    words = [values[:0]]
+    kept = 0
+    for start, end in ranges:
+        first = np.searchsorted(starts, start, side='right')
+        last = np.searchsorted(starts, end, side='left')
+        index += [np.array([kept], dtype=np.int64), kept + starts[first:last] - start]
+        words += [values[first-1:first], values[first:last]]
+        kept += end - start
+    index = np.concatenate(index)
+    words = np.concatenate(words)
+    changed = np.concatenate(([True], words[1:] != words[:-1]))[:len(words)]
+    return index[changed], words[changed]
+
+def sample_times(indexes, info):
+    """Converts sample indexes in the saved data to seconds, honouring fragment gaps."""
+    indexes = np.asarray(indexes)
+    frag = np.searchsorted(info['frag_starts'], indexes, side='right') - 1
+    frag = np.maximum(frag, 0)
+    return (indexes - info['frag_starts'][frag] + info['frag_ticks'][frag]) / info['sample_rate']
+
+def imp_check(info):
+    """Sorts the channels into good, short and open ones by impedance; False on error."""
+    if not info['open_en']:
+        info['short_ch'] = []
+        info['open_ch'] = []
+        info['good_ch'] = list(info['work_ch'])
+        return True
+    files = os.listdir(info['db'])
+    file_list = []
+    for file in files:  
+        if re.search(r'.*\.csv', file):
+            file_list.append(file)
+    if len(file_list)>1:
+        report_error("输入文件夹中有多个阻抗csv文件")
+        return False
+    elif len(file_list) == 1:
+        imp_file_path = os.path.join(info['db'], file_list[0])
+        save_log("Parsing impedance from: "+imp_file_path+"...")
+        with open(imp_file_path, 'r') as impfile:
+            reader = DictReader(impfile)
+            imp_csv = [eval(row['Impedance Magnitude at 1000 Hz (ohms)']) for row in reader]
+            info['imp'] = []
+            for c in info['work_ch']:
+                info['imp'].append(imp_csv[c])
+    elif len(file_list) == 0:
+        save_log("Do not get impedance file, use the impedance stored in rhd file")
+    
+    info['short_ch'] = []
+    info['open_ch'] = []
+    info['good_ch'] = []
+    for i, c in enumerate(info['work_ch']):
+        if info['imp'][i] > info['threshold']:
+            save_log ("Channel "+str(c)+" is opening. Impedance: "+str(info['imp'][i]/1e6)+" MΩ.")
+            info['open_ch'].append(c)
+        elif info['imp'][i] < 10000:
+            save_log("Impedance of Channel "+str(c)+" is too low. Impedance: "+str(info['imp'][i]/1e6)+" MΩ.")
+            info['good_ch'].append(c)
+            info['short_ch'].append(c)
+        else:
+            info['good_ch'].append(c)
+    print("")
+    return True
+
+def imp_decode(data, info):
+    if not imp_check(info):
+        return 1
+    if not info['open_en']:
+        return data
+    data = np.delete(data, info['open_ch'], axis=0)
+    return data
+
+def reference_groups(info):
+    """Row selections of the channel groups to reference (see common_reference)."""
+    from common_reference import CHANNEL_GROUPS_FILE, read_channel_groups, group_rows
+    channels = info['good_ch']
+    groups = [('all', slice(None))]
+    group_file = os.path.join(info['db'], CHANNEL_GROUPS_FILE)
+    if os.path.exists(group_file):
+        save_log("Parsing reference groups from: "+group_file+"...")
+        groups = group_rows(channels, read_channel_groups(group_file))
+    ref_groups = []
+    for name, rows in groups:
+        group_ch = channels[rows] if isinstance(rows, slice) else [channels[r] for r in rows]
+        if len(group_ch) < 2:
+            save_log("Reference group "+name+" has less than 2 channels, not referenced.")
+            continue
+        if len(groups) > 1:
+            save_log("Reference group "+name+": channels "+str(group_ch))
+        ref_groups.append(rows)
+    if info['ref_mode'] == 'pca':
+        save_log("Removing "+str(info['ref_components'])+" common components per reference group (PCA).")
+    return ref_groups
+
+def ref_process (data, info):    
+    from common_reference import common_reference, reference_chunk, estimate_components, group_size
+    if info['ref_en']:
+        groups = reference_groups(info)
+        num_channels, num_samples = data.shape
+        chunk = reference_chunk(num_channels, data.itemsize)
+        components = None
+        if info['ref_mode'] == 'pca':
+            components = [estimate_components(data, rows, min(info['ref_components'], group_size(rows, num_channels) - 1), chunk)
+                          for rows in groups]
+        # A whole number of chunks at a time, to show progress (and allow
+        # cancelling) in between without changing the result.
+        step = chunk * max(1, num_samples // (chunk * 20))
+        for start in range(0, num_samples, step):
+            common_reference(data[:, start:start+step], groups, info['ref_mode'], num_components=info['ref_components'], components=components)
+            add_progress(info['recording_bytes'] * (min(start+step, num_samples) - start) / num_samples)
+    return data
+
+def add_digital_events(fd, runs, channels, length, info):
+    """Adds rising/falling edge Events and high-level Intervals for every digital channel.
+
+    runs are the digital words of the saved data (see get_word_runs), length
+    the number of saved samples.
+    """
+    from intanutil.digital_channels import get_run_edges
+    from NexFileData import Event, Interval
+    edges = get_run_edges(runs[0], runs[1], channels)
+    for ch, edge in zip(channels, edges):
+        name = ch['custom_channel_name']
+        fd.Events.append(Event(name+'_rise', sample_times(edge['rising'], info)))
+        fd.Events.append(Event(name+'_fall', sample_times(edge['falling'], info)))
+        starts = edge['rising']
+        ends = edge['falling']
+        if edge['initial']:
+            starts = np.insert(starts, 0, 0)
+        if len(ends) < len(starts):
+            ends = np.append(ends, length-1)
+        fd.Intervals.append(Interval(name, sample_times(starts, info), sample_times(ends, info)))
+
+def nex_file_data(info, length):
+    """FileData with the events and intervals of the output file, for length saved samples."""
+    from NexFileData import FileData, Event, Interval
+    fd = FileData()
+    fd.TimestampFrequency = info['sample_rate']
+    end_time = sample_times(length-1, info)
+    fd.Events.append(Event('StartStop', [0, end_time]))
+    fd.Intervals.append(Interval('AllFile', [0], [end_time]))
+    for dig in ['board_dig_in', 'board_dig_out']:
+        add_digital_events(fd, info['dig_runs'][dig], info['dig_channels'][dig], length, info)
+    if len(info['motion_marks']):
+        marks = np.array(info['motion_marks'])
+        fd.Intervals.append(Interval('motion', sample_times(marks[:, 0], info), sample_times(marks[:, 1], info)))
+    if len(info['removed_spans']):
+        spans = np.array(info['removed_spans'])
+        fd.Intervals.append(Interval('removed', spans[:, 0], spans[:, 1]))
+    return fd
+
+def channel_names(info):
+    names = []
+    for c in info['good_ch']:
+        if c in info['short_ch']:
+            names.append('ch'+str(info['work_ch'][c])+'(short)')
+        else:
+            names.append('ch'+str(info['work_ch'][c]))
+    return names
+
+def nex_name(info):
+    if info['file_format']:
+        f_name = info['file_name'] + ".nex5"
+    else:
+        f_name = info['file_name'] + ".nex"
+    info['nex_name'] = f_name
+    if os.path.exists(f_name):
+        os.remove(f_name)
+    return f_name
+
+def save_nex (data, info):
+    from NexFileData import Continuous
+    import NexFileWriters
+    save_log ("Saving data into file, may take several minutes. Please wait ...\n")
+    f_name = nex_name(info)
+    ch, lenth = data.shape
+    file_abspath = os.path.abspath(f_name)
+    fd = nex_file_data(info, lenth)
+    # Collecting the channels counts for half of the pass, writing the file for the other half.
+    for i, (c, c_name) in enumerate(zip(info['good_ch'], channel_names(info))):
+        fd.Continuous.append(Continuous(c_name, info['sample_rate'], info['frag_ticks']/info['sample_rate'], info['frag_starts'], data[i].tolist()))
+        add_progress(info['recording_bytes'] / 2 / ch)
+    if not info['file_format']:
+        writerNex = NexFileWriters.NexFileWriter()
+        writerNex.WriteDataToNexFile(fd, f_name)
+    else:
+        writerNex5 = NexFileWriters.Nex5FileWriter()
+        writerNex5.WriteDataToNex5File(fd, f_name)
+    add_progress(info['recording_bytes'] / 2)
+    save_log ("Process complete.")
+    save_log ("Location of output mat file: "+str(file_abspath))
+
+def stream_scan(file_list, info):
+    """Streaming counterpart of decode_rhds, motion_detect and data_merge.
+
+    Channels, sample rate and timestamp gaps come from the file headers and
+    indexes; only the aux inputs (for motion detection) and the digital
+    words are read, a chunk at a time, and kept as window scores and runs.
+    Sets the same crop and event info as data_merge, plus 'kept_ranges'.
+    Returns False on error.
+    """
+    from load_intan_rhd_format import DataBlockReader
+    from intanutil.digital_channels import get_word_runs
+    from intanutil.motion_detection import detect_motion_chunks
+    scans = info['rhd_scan']
+    header = scans[0]['header']
+    if len(set(ch_info['port_prefix'] for ch_info in header['amplifier_channels'])) > 1:
+        report_error("当前版本暂不支持记录多个port的rhd文件")
+        return False
+    info['imp'] = [ch_info['electrode_impedance_magnitude'] for ch_info in header['amplifier_channels']]
+    info['work_ch'] = sorted(ch_info['native_order'] for ch_info in header['amplifier_channels'])
+    info['sample_rate'] = scans[0]['sample_rate']
+    length = sum(scan['num_samples'] for scan in scans)
+    save_log("Get "+str(length/info['sample_rate'])+" seconds data in total with sample rate of "+str(info['sample_rate']/1000)+" kHz.\n")
+
+    digs = ['board_dig_in', 'board_dig_out']
+    info['dig_channels'] = {dig: [] for dig in digs}
+    for scan in scans:
+        for dig in digs:
+            if scan['header']['num_'+dig+'_channels'] > 0 and scan['num_samples'] > 0:
+                info['dig_channels'][dig] = scan['header'][dig+'_channels']
+    digs = [dig for dig in digs if len(info['dig_channels'][dig])]
+    motion_en = info['motion_en']
+    if motion_en and not all(scan['header']['num_aux_input_channels'] > 0 and scan['num_samples'] > 0 for scan in scans):
+        save_log("No aux input channels recorded, motion detection skipped.")
+        motion_en = False
+
+    runs = {dig: ([], []) for dig in digs}
+    last_word = {}
+    def side_signals():
+        # Yields the aux input chunks, collecting the digital word runs on the way.
+        file_start = 0
+        for i, (file_path, _) in enumerate(file_list):
+            reader = DataBlockReader(file_path)
+            file_header = reader.header
+            signal_types = (['aux_input'] if motion_en else []) + digs
+            pos = file_start
+            for data in reader.blocks(max(1, stream_samples(info) // file_header['num_samples_per_data_block']), signal_types):
+                n = len(data['t_amplifier'])
+                for dig in digs:
+                    words = data[dig+'_raw'] if file_header['num_'+dig+'_channels'] > 0 else np.zeros(n, dtype=np.uint16)
+                    starts, values = get_word_runs(words)
+                    if len(values) and last_word.get(dig) == values[0]:
+                        # The run goes on from the previous chunk.
+                        starts, values = starts[1:], values[1:]
+                    if len(values):
+                        last_word[dig] = values[-1]
+                    runs[dig][0].append(starts + pos)
+                    runs[dig][1].append(values)
+                if motion_en:
+                    yield np.multiply(37.4e-6, data['aux_input_data'])     # units = volts
+                pos += n
+            reader.close()
+            file_start += scans[i]['num_samples']
+            add_progress(scan_bytes(scans[i]))
+
+    info['motion_list'] = []
+    if motion_en or len(digs):
+        signals = (['aux inputs'] if motion_en else []) + (['digital words'] if len(digs) else [])
+        save_log("Reading "+" and ".join(signals)+"...")
+        if motion_en:
+            add_motion_periods(info, detect_motion_chunks(side_signals(), info['sample_rate']/4, threshold=info['motion_threshold']))
+        else:
+            for chunk in side_signals():
+                pass
+    else:
+        add_progress(info['recording_bytes'])
+
+    kept_ranges = crop_timeline(info, scan_steps(scans), length)
+    info['kept_ranges'] = kept_ranges
+    info['dig_runs'] = {}
+    for dig in ['board_dig_in', 'board_dig_out']:
+        if dig in runs:
+            full = (np.concatenate(runs[dig][0] + [np.zeros(0, dtype=np.int64)]), np.concatenate(runs[dig][1] + [np.zeros(0, dtype=np.uint16)]))
+        else:
+            full = (np.zeros(1 if length else 0, dtype=np.int64), np.zeros(1 if length else 0, dtype=np.uint16))
+        info['dig_runs'][dig] = crop_runs(full, kept_ranges)
+    return True
+
+def stream_blocks(file_list, info, rows, block_samples, groups=None, components=None):
+    """Yields the saved data block_samples samples at a time.
+
+    The files are decoded a chunk at a time (read_data_chunks), the kept
+    sample ranges and the rows channels are copied into one reusable block,
+    and with groups every block is referenced like ref_process does (with
+    the given PCA components).  A block is only valid until the next one is
+    requested.
+    """
+    from load_intan_rhd_format import read_data_chunks
+    from common_reference import common_reference
+    block = np.empty((len(rows), block_samples))
+    pos = 0
+    k = 0
+    kept_ranges = info['kept_ranges']
+    for chunk in read_data_chunks([f[0] for f in file_list], chunk_samples=block_samples):
+        data = chunk['amplifier_data']
+        chunk_start = chunk['sample_offset']
+        chunk_end = chunk_start + data.shape[1]
+        while k < len(kept_ranges) and kept_ranges[k][0] < chunk_end:
+            start = max(kept_ranges[k][0], chunk_start)
+            end = min(kept_ranges[k][1], chunk_end)
+            while start < end:
+                n = min(end - start, block_samples - pos)
+                block[:, pos:pos+n] = data[rows, start-chunk_start:start-chunk_start+n]
+                pos += n
+                start += n
+                if pos == block_samples:
+                    if groups is not None:
+                        common_reference(block, groups, info['ref_mode'], num_components=info['ref_components'], components=components)
+                    yield block
+                    pos = 0
+            if kept_ranges[k][1] > chunk_end:
+                break
+            k += 1
+    if pos:
+        if groups is not None:
+            common_reference(block[:, :pos], groups, info['ref_mode'], num_components=info['ref_components'], components=components)
+        yield block[:, :pos]
+
+def stream_save(file_list, info):
+    """Streaming counterpart of imp_decode, ref_process and save_nex.
+
+    The data pass from the files to the output file in blocks sized by
+    info['memory_limit'] (MB), aligned on the chunks of common_reference so
+    the output is the same as the in-memory path.  PCA components and the
+    16-bit scales of .nex files need the whole recording, so each of them
+    takes one extra pass over the files first.
+    """
+    from common_reference import reference_chunk, pick_chunks, group_size, ComponentEstimator
+    from nex_stream_writer import NexStreamWriter, float_to_short_scales
+    save_log ("Saving data into file, may take several minutes. Please wait ...\n")
+    sample_rate = info['sample_rate']
+    rows = np.delete(np.arange(len(info['work_ch'])), info['open_ch'])
+    num_points = sum(end-start for start, end in info['kept_ranges'])
+    groups = reference_groups(info) if info['ref_en'] else None
+    block_samples = stream_samples(info, len(rows))
+    save_log("Streaming the data in blocks of "+str(block_samples)+" samples.")
+
+    components = None
+    passes = []
+    if groups is not None and info['ref_mode'] == 'pca':
+        passes.append('components')
+    if not info['file_format']:
+        passes.append('scales')
+    passes.append('write')
+
+    for p, stage in enumerate(passes):
+        save_log("Pass "+str(p+1)+" of "+str(len(passes))+": "+stage+".")
+        # Every pass counts the size of the recording.
+        progress = lambda samples: add_progress(info['recording_bytes'] * samples / num_points)
+        if stage == 'components':
+            # Accumulate the covariance of the chunks estimate_components picks.
+            chunk = reference_chunk(len(rows))
+            picks = set(pick_chunks(num_points, chunk))
+            estimators = [ComponentEstimator() for g in groups]
+            block_start = 0
+            for block in stream_blocks(file_list, info, rows, block_samples):
+                for c in range(block_start // chunk, (block_start + block.shape[1] - 1) // chunk + 1):
+                    if c in picks:
+                        for g, group in enumerate(groups):
+                            estimators[g].add(block[group, c*chunk-block_start:(c+1)*chunk-block_start])
+                block_start += block.shape[1]
+                progress(block.shape[1])
+            components = [estimators[g].components(min(info['ref_components'], group_size(group, len(rows)) - 1))
+                          for g, group in enumerate(groups)]
+        elif stage == 'scales':
+            minimums = np.full(len(rows), np.inf, dtype=np.float32)
+            maximums = np.full(len(rows), -np.inf, dtype=np.float32)
+            for block in stream_blocks(file_list, info, rows, block_samples, groups, components):
+                values = block.astype(np.float32)
+                np.minimum(minimums, values.min(axis=1), out=minimums)
+                np.maximum(maximums, values.max(axis=1), out=maximums)
+                progress(block.shape[1])
+            scales = float_to_short_scales(minimums, maximums)
+        else:
+            f_name = nex_name(info)
+            writer = NexStreamWriter(nex_file_data(info, num_points), f_name, channel_names(info), sample_rate,
+                                     info['frag_ticks']/sample_rate, info['frag_starts'], num_points,
+                                     nex5=bool(info['file_format']), scales=None if info['file_format'] else scales)
+            try:
+                for block in stream_blocks(file_list, info, rows, block_samples, groups, components):
+                    writer.write(block)
+                    progress(block.shape[1])
+            except BaseException:
+                writer.discard()
+                raise
+            writer.close()
+    save_log ("Process complete.")
+    save_log ("Location of output mat file: "+str(os.path.abspath(info['nex_name'])))
+
+def stream_samples(info, num_rows=None):
+    """Samples per block for streaming within info['memory_limit'] (MB).
+
+    With num_rows (the saved channels), the block is a whole number of
+    common_reference chunks.
+    """
+    from common_reference import reference_chunk
+    num_channels = max(info['rhd_scan'][0]['header']['num_amplifier_channels'], 1)
+    # Bytes held per sample: raw words, float64 copies and notch filter work
+    # arrays for every channel, plus the saved block itself.
+    bytes_per_sample = 8 * 7 * num_channels
+    limit = info['memory_limit'] * 1024 * 1024
+    if num_rows is None:
+        return max(1024, int(limit // bytes_per_sample))
+    chunk = reference_chunk(num_rows)
+    block_samples = max(1, int(limit // (bytes_per_sample * chunk))) * chunk
+    if block_samples * bytes_per_sample > limit:
+        save_log("Memory limit too low, using about "+str(block_samples * bytes_per_sample // (1024 * 1024))+" MB.")
+    return block_samples
+
+def gen_ofb(ofb_info):
+    pre_name = ofb_info['file_name'] + '_pre.ofb'
+    post_name = ofb_info['file_name'] + '_post.ofb'
+    with open(pre_name, "w") as f:
+        f.write("File " + ofb_info['nex_name'] + "\n")
+        if ofb_info['filter_en']:
+            f.write("ForEachChannel Filter\n")
+        if ofb_info['detect_en']:
+            f.write("ForEachChannel Detect\n")
+        if ofb_info['sort_en']:
+            f.write("ForEachChannel " + ofb_info['sort_type'] + "\n")
+
+        if ofb_info['filter_en']:
+            f.write("Set FilterFreq " + ofb_info['filter_cutoff'] + "\n")
+            f.write("Set FilterType " + ofb_info['filter_type'] + "\n")
+            f.write("Set FilterPoles " + ofb_info['filter_pole'] + "\n")
+
+        if ofb_info['align_en']:
+            f.write("Set AlignDuringDetect "+"1"+"\n")
+            f.write("Set AlignType "+"4"+"\n")
+
+        if ofb_info['detect_en']:
+            f.write("Set DetectMicrovolts " + ofb_info['detect_threshold'] + "\n")
+
+        f.write("Set FeatureX 0\n")
+        f.write("Set FeatureY 1\n")
+        f.write("Set FeatureZ 2\n")
+        f.write("Process\n")
+    with open(post_name, "w") as f:
+        f.write("ForEachFile ExportToNex\n")
+        f.write("Set SaveNexCont 1\n")
+        f.write("Set SaveNexProcessedCont 1\n")
+        f.write("Set SaveNexWaveforms 1\n")
+        f.write("Set SaveNexUnsorted 0\n")
+        f.write("Set SaveNexUnitTemplates 0\n")
+        f.write("Process\n")
+
+class Config:
+    """Settings of a conversion, as the GUI shows them and the config file keeps them.
+
+    Checkboxes are 0/1, combobox selections are indexes and entry fields the
+    text typed in; info() checks and converts them for one recording.
+    """
+
+    defaults = {
+        'ref_en': 0, 'open_en': 0, 'threshold': 2, 'ref_mode': 0, 'ref_components': 3,
+        'delete_en': 0, 'delete_string': '', 'motion_en': 0, 'motion_mode': 0, 'motion_threshold': 5,
+        'crop_mode': 0, 'file_format': 0, 'file_name': 'out', 'stream_en': 0, 'memory_limit': 2048,
+        'gen_ofb_en': 0, 'filter_en': 0, 'filter_type': '', 'filter_cutoff': '', 'filter_pole': '',
+        'detect_en': 0, 'detect_threshold': '', 'sort_en': 0, 'sort_type': '', 'align_en': 0,
+        'workers': 0, 'trace_memory': 0,
+    }
+    # Saved in the config file; the crop, the output name, the number of
+    # worker processes (0: one per CPU) and whether to trace memory
+    # allocations in the profile (slow) are set for every run.
+    saved = ['ref_en', 'open_en', 'ref_mode', 'ref_components', 'threshold', 'file_format', 'gen_ofb_en',
+             'filter_en', 'filter_cutoff', 'filter_type', 'filter_pole', 'detect_en', 'detect_threshold',
+             'sort_en', 'sort_type', 'align_en', 'crop_mode', 'motion_en', 'motion_mode', 'motion_threshold',
+             'stream_en', 'memory_limit']
+
+    def __init__(self, **settings):
+        for key, value in self.defaults.items():
+            setattr(self, key, value)
+        for key, value in settings.items():
+            if key not in self.defaults:
+                raise Exception('Unknown setting: ' + key)
+            setattr(self, key, value)
+
+    @classmethod
+    def load(cls, filename=CONFIG_FILE):
+        with open(filename, 'r') as cfg_f:
+            cfg = json.load(cfg_f)
+        return cls(**{key: value for key, value in cfg.items() if key in cls.defaults})
+
+    def save(self, filename=CONFIG_FILE):
+        cfg = {key: getattr(self, key) for key in self.saved}
+        with open(filename, 'w') as cfg_f:
+            json.dump(cfg, cfg_f, indent=4)
+
+    def info(self, db):
+        """The info dict of a conversion of recording folder db.
+
+        Raises an Exception with the message to show if a setting is invalid.
+        """
+        from interval_set import IntervalSet
+
+        info = {}
+        info['db'] = db
+        try:
+            info['threshold'] = int(self.threshold)*1000000
+        except ValueError:
+            raise Exception("阻抗筛选：阈值格式错误")
+        info['open_en'] = self.open_en
+        info['ref_en'] = self.ref_en
+        info['ref_mode'] = ['mean', 'median', 'pca'][self.ref_mode]
+        try:
+            info['ref_components'] = int(self.ref_components)
+        except ValueError:
+            raise Exception("参考：PCA成分数格式错误")
+        if info['ref_components'] < 1:
+            raise Exception("参考：PCA成分数格式错误")
+        info['delete_en'] = self.delete_en
+        info['align_en'] = self.align_en
+        info['workers'] = self.workers or os.cpu_count() or 1
+        info['motion_en'] = self.motion_en
+        info['motion_mode'] = self.motion_mode
+        try:
+            info['motion_threshold'] = float(self.motion_threshold)
+        except ValueError:
+            raise Exception("运动检测：阈值格式错误")
+        info['stream_en'] = self.stream_en
+        try:
+            info['memory_limit'] = int(self.memory_limit)
+        except ValueError:
+            raise Exception("流式处理：内存上限格式错误")
+
+        delete_list = []
+        if info['delete_en']:
+            try:
+                delete_list = list(IntervalSet.parse(self.delete_string))
+            except Exception:
+                raise Exception("噪声段删除：输入格式错误")
+        info['delete_list'] = delete_list
+        info['crop_mode'] = self.crop_mode
+        info['file_format'] = self.file_format
+        info['file_name'] = os.path.join(info['db'], self.file_name)
+        info['trace_memory'] = self.trace_memory
+        return info
+
+    def ofb_info(self, info):
+        """Settings of gen_ofb for the output of info."""
+        ofb_info = {}
+        ofb_info['file_name'] = info['file_name']
+        ofb_info['nex_name'] = info['nex_name']
+        ofb_info['filter_en'] = self.filter_en
+        ofb_info['align_en'] = self.align_en
+        if ofb_info['filter_en']:
+            ofb_info['filter_pole'] = str(self.filter_pole)
+            ofb_info['filter_cutoff'] = str(self.filter_cutoff)
+            ofb_info['filter_type'] = self.filter_type
+        ofb_info['detect_en'] = self.detect_en
+        if ofb_info['detect_en']:
+            ofb_info['detect_threshold'] = str(self.detect_threshold)
+        ofb_info['sort_en'] = self.sort_en
+        if ofb_info['sort_en']:
+            ofb_info['sort_type'] = self.sort_type
+        return ofb_info
+
+def disk_bytes(file_list):
+    """Size on disk of the rhd files (or the dat folder) of file_list."""
+    total = 0
+    for file_path, _ in file_list:
+        if os.path.isdir(file_path):
+            total += sum(entry.stat().st_size for entry in os.scandir(file_path) if entry.is_file())
+        else:
+            total += os.path.getsize(file_path)
+    return total
+
+def convert_stages(info, config, profiler):
+    """Runs the stages of a conversion under profiler; False on error, Cancelled if cancelled."""
+    with profiler.stage('get_rhds') as stage:
+        file_list = get_rhds(info)
+        if len(file_list) == 0:
+            return False
+        stage['bytes_in'] = info['disk_bytes'] = disk_bytes(file_list)
+        info['recording_bytes'] = sum(scan_bytes(scan) for scan in info['rhd_scan'])
+
+    if info['stream_en']:
+        # Bounded memory: the data go from the files to the output in blocks.
+        passes = 2 + (info['ref_en'] and info['ref_mode'] == 'pca') + (not info['file_format'])
+        start_progress(info['recording_bytes'], passes)
+        with profiler.stage('stream_scan', info['disk_bytes']):
+            if not stream_scan(file_list, info):
+                return False
+        with profiler.stage('imp_check'):
+            if not imp_check(info):
+                return False
+        with profiler.stage('stream_save', (passes - 1) * info['disk_bytes']) as stage:
+            stream_save(file_list, info)
+            stage['bytes_out'] = os.path.getsize(info['nex_name'])
+    else:
+        start_progress(info['recording_bytes'], 3 + bool(info['ref_en']))
+        with profiler.stage('decode_rhds', info['disk_bytes']) as stage:
+            data_list = decode_rhds(file_list, info)
+            if len(data_list) == 0:
+                return False
+            stage['bytes_out'] = sum(d.nbytes for d in data_list)
+
+        with profiler.stage('motion_detect'):
+            motion_detect(info)
+        with profiler.stage('data_merge', sum(d.nbytes for d in data_list)) as stage:
+            data = data_merge(data_list, info)
+            stage['bytes_out'] = data.nbytes
+        with profiler.stage('imp_decode', data.nbytes) as stage:
+            data = imp_decode(data, info)
+            if not (type(data) is np.ndarray):
+                print("error")
+                print(type(data))
+                return False
+            stage['bytes_out'] = data.nbytes
+        with profiler.stage('ref_process', data.nbytes) as stage:
+            data = ref_process(data, info)
+            stage['bytes_out'] = data.nbytes
+        with profiler.stage('save_nex', data.nbytes) as stage:
+            save_nex(data, info)
+            stage['bytes_out'] = os.path.getsize(info['nex_name'])
+        del data
+
+    if config.gen_ofb_en:
+        with profiler.stage('gen_ofb') as stage:
+            gen_ofb(config.ofb_info(info))
+            stage['bytes_out'] = sum(os.path.getsize(info['file_name'] + suffix) for suffix in ['_pre.ofb', '_post.ofb'])
+    return True
+
+def save_profile(info, profiler, status):
+    """Writes the stage report of a conversion to <output name>_profile.json."""
+    filename = info['file_name'] + '_profile.json'
+    if not os.path.isdir(os.path.dirname(os.path.abspath(filename))):
+        return
+    recording = {}
+    if 'rhd_scan' in info:
+        scans = info['rhd_scan']
+        recording = {'files': len(scans), 'channels': scans[0]['header']['num_amplifier_channels'],
+                     'samples': sum(scan['num_samples'] for scan in scans), 'sample_rate': scans[0]['sample_rate'],
+                     'disk_bytes': info.get('disk_bytes'), 'data_bytes': info.get('recording_bytes')}
+    settings = {key: info[key] for key in ['open_en', 'ref_en', 'ref_mode', 'ref_components', 'delete_list', 'crop_mode',
+                                           'motion_en', 'motion_mode', 'file_format', 'stream_en', 'memory_limit', 'workers']}
+    environment = {'python': sys.version.split()[0], 'numpy': np.__version__, 'platform': sys.platform, 'cpu_count': os.cpu_count()}
+    try:
+        profiler.save(filename, session=info['db'], output=info.get('nex_name'), status=status,
+                      recording=recording, settings=settings, environment=environment)
+    except OSError as e:
+        save_log("Could not write the profile "+filename+": "+str(e))
+
+def convert(db, config):
+    """Converts the recording in folder db with the settings of config.
+
+    Returns the info dict of the conversion (info['nex_name'] is the output
+    file), or None if it failed (the error has been reported) or was
+    cancelled.  The time, data sizes and memory of every stage are written
+    to <output name>_profile.json (see StageProfiler), whatever the outcome.
+    """
+    from stage_profiler import StageProfiler
+    print("")
+    print("="*80)
+    save_log ("Start a new converter")
+    if not db:
+        report_error("必须指定输入数据文件夹")
+        return None
+    try:
+        info = config.info(db)
+    except Exception as e:
+        report_error(str(e))
+        return None
+
+    profiler = StageProfiler(trace_memory=info['trace_memory'])
+    status = 'error'
+    try:
+        status = 'ok' if convert_stages(info, config, profiler) else 'failed'
+    except Cancelled:
+        save_log("Conversion cancelled.")
+        status = 'cancelled'
+    finally:
+        profiler.close()
+        save_profile(info, profiler, status)
+    if status != 'ok':
+        return None
+    finish_progress()
+    return info
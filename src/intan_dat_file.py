@@ -0,0 +1,174 @@
+#! /bin/env python
+#
+# Memory-mapped access to Intan "one file per signal type" recordings.
+#
+# Such a recording is a folder holding info.rhd (a data file header without
+# data blocks), time.dat (int32 timestamps), amplifier.dat (int16 samples,
+# all channels of one sample stored together) and, when enabled,
+# auxiliary.dat (uint16, every aux sample repeated four times) and
+# digitalin.dat / digitalout.dat (uint16 words).  Unlike the block-interleaved
+# .rhd format, every signal is one plain array on disk, so it can be used
+# through a memory map without decoding.
+
+import os
+import numpy as np
+
+from intanutil.read_header import read_header
+from intanutil.notch_filter import notch_filter_chunk
+from intanutil.data_to_result import data_to_result
+from intanutil.digital_channels import extract_digital_channels
+
+def is_dat_folder(folder):
+    """True if folder holds a one-file-per-signal-type recording."""
+    return os.path.isfile(os.path.join(folder, 'info.rhd')) and os.path.isfile(os.path.join(folder, 'time.dat'))
+
+def map_dat(filename, dtype, shape):
+    """Memory maps filename as an array of the given shape (zeros if empty)."""
+    if np.prod(shape) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', shape=shape)
+
+class IntanDatFile:
+    """Memory-mapped Intan one-file-per-signal-type recording.
+
+    info.rhd is parsed with read_header.  amplifier_data is an int16
+    channels x samples view of amplifier.dat (mV = 0.000195 * counts),
+    timestamps the int32 sample timestamps of time.dat, aux_input_raw a
+    channels x (samples / 4) view of auxiliary.dat, and board_dig_in_raw /
+    board_dig_out_raw the packed digital words (None if not recorded).
+    Nothing is read from the .dat files until the arrays are used.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, 'info.rhd'), 'rb') as fid:
+            self.header = read_header(fid)
+        header = self.header
+        self.sample_rate = header['sample_rate']
+
+        time_file = os.path.join(folder, 'time.dat')
+        filesize = os.path.getsize(time_file)
+        if filesize % 4 != 0:
+            raise Exception('Something is wrong with file size : time.dat should hold whole int32 timestamps')
+        self.num_samples = filesize // 4
+        self.record_time = self.num_samples / self.sample_rate
+        self.timestamps = map_dat(time_file, np.int32, (self.num_samples,))
+
+        nch = header['num_amplifier_channels']
+        amplifier_file = os.path.join(folder, 'amplifier.dat')
+        if nch > 0:
+            if os.path.getsize(amplifier_file) != 2 * nch * self.num_samples:
+                raise Exception('Something is wrong with file size : amplifier.dat does not match time.dat')
+            self.amplifier_data = map_dat(amplifier_file, np.int16, (self.num_samples, nch)).T
+        else:
+            self.amplifier_data = np.zeros((0, self.num_samples), dtype=np.int16)
+
+        self.aux_input_raw = None
+        naux = header['num_aux_input_channels']
+        aux_file = os.path.join(folder, 'auxiliary.dat')
+        if naux > 0 and os.path.isfile(aux_file):
+            if os.path.getsize(aux_file) != 2 * naux * self.num_samples:
+                raise Exception('Something is wrong with file size : auxiliary.dat does not match time.dat')
+            self.aux_input_raw = map_dat(aux_file, np.uint16, (self.num_samples, naux))[::4].T
+
+        self.board_dig_in_raw = None
+        self.board_dig_out_raw = None
+        for name, key in [('digitalin.dat', 'board_dig_in'), ('digitalout.dat', 'board_dig_out')]:
+            path = os.path.join(folder, name)
+            if header['num_'+key+'_channels'] > 0 and os.path.isfile(path):
+                if os.path.getsize(path) != 2 * self.num_samples:
+                    raise Exception('Something is wrong with file size : '+name+' does not match time.dat')
+                setattr(self, key+'_raw', map_dat(path, np.uint16, (self.num_samples,)))
+
+    def close(self):
+        """Drops the memory maps.  Arrays already returned stay valid."""
+        self.timestamps = None
+        self.amplifier_data = None
+        self.aux_input_raw = None
+        self.board_dig_in_raw = None
+        self.board_dig_out_raw = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def scan_dat_folder(folder):
+    """Summarizes a one-file-per-signal-type recording like scan_header.
+
+    Besides the scan_header keys, 'gaps' lists [sample index, jump] pairs for
+    every timestamp step other than one.
+    """
+
+    dat = IntanDatFile(folder)
+    timestamps = np.asarray(dat.timestamps, dtype=np.int64)
+    steps = np.diff(timestamps)
+    jumps = np.flatnonzero(steps != 1)
+
+    info = {}
+    info['filename'] = folder
+    info['header'] = dat.header
+    info['sample_rate'] = dat.sample_rate
+    info['num_amplifier_channels'] = dat.header['num_amplifier_channels']
+    info['num_samples'] = dat.num_samples
+    info['first_timestamp'] = int(timestamps[0]) if dat.num_samples > 0 else None
+    info['last_timestamp'] = int(timestamps[-1]) if dat.num_samples > 0 else None
+    info['gaps'] = [[int(i) + 1, int(steps[i])] for i in jumps]
+    dat.close()
+    return info
+
+def read_dat_data(folder, raw=False):
+    """Reads a one-file-per-signal-type recording like read_data reads an .rhd file.
+
+    Returns (result, record_time, sample_rate) with the same keys as
+    read_data for amplifier, aux input and digital data.  With raw=True the
+    amplifier data stay a zero-copy int16 view of amplifier.dat, with
+    'amplifier_scale', 'amplifier_offset' and 'amplifier_notch_frequency' as
+    in read_data.
+    """
+
+    dat = IntanDatFile(folder)
+    header = dat.header
+    data_present = dat.num_samples > 0
+
+    data = {}
+    if data_present:
+        data['t_amplifier'] = dat.timestamps / dat.sample_rate
+        data['t_dig'] = data['t_amplifier']
+
+        notch_frequency = 0
+        if header['notch_filter_frequency'] > 0 and header['version']['major'] < 3:
+            notch_frequency = header['notch_filter_frequency']
+
+        if raw:
+            data['amplifier_data'] = dat.amplifier_data
+            data['amplifier_scale'] = 0.000195      # units = mV per count
+            data['amplifier_offset'] = 0
+            data['amplifier_notch_frequency'] = notch_frequency
+        else:
+            data['amplifier_data'] = np.multiply(0.000195, dat.amplifier_data, order='C')      # units = mV
+            if notch_frequency > 0 and header['num_amplifier_channels'] > 0:
+                print('Applying notch filter...')
+                data['amplifier_data'] = notch_filter_chunk(data['amplifier_data'], dat.sample_rate, notch_frequency, 10,
+                                                            block_size=header['num_samples_per_data_block'])[0]
+
+        if dat.aux_input_raw is not None:
+            data['aux_input_data'] = np.multiply(37.4e-6, dat.aux_input_raw, order='C')     # units = volts
+            data['t_aux_input'] = data['t_amplifier'][::4]
+
+        for key in ['board_dig_in', 'board_dig_out']:
+            words = getattr(dat, key+'_raw')
+            if words is None:
+                continue
+            if raw:
+                data[key+'_raw'] = words
+            else:
+                data[key+'_data'] = extract_digital_channels(words, header[key+'_channels'])
+
+        num_gaps = np.sum(np.not_equal(np.diff(dat.timestamps.astype(np.int64)), 1))
+        if not num_gaps == 0:
+            print('Warning: {0} gaps in timestamp data found.  Time scale will not be uniform!'.format(num_gaps))
+
+    result = data_to_result(header, data, data_present)
+    return result, dat.record_time, dat.sample_rate
@@ -0,0 +1,60 @@
+#! /bin/env python
+#
+# Decoding of the packed 16-bit board digital input/output words.
+
+import numpy as np
+
+def extract_digital_channels(words, channels):
+    """Returns a (channels x samples) bool array with the state of every channel.
+
+    words holds one 16-bit word per sample; bit native_order of each word is
+    the state of that digital channel.  All channels are decoded in one pass.
+    """
+
+    masks = np.array([1 << ch['native_order'] for ch in channels], dtype=np.uint16)
+    return np.not_equal(np.bitwise_and(words[np.newaxis, :], masks[:, np.newaxis]), 0)
+
+def get_digital_edges(words, channels):
+    """Finds rising and falling edges of every digital channel.
+
+    Only the samples where the packed word changes are examined, so the cost
+    scales with the number of transitions rather than with the recording
+    length.  Returns one dictionary per channel with 'rising' and 'falling'
+    (sample indices of the first sample after the edge) and 'initial' (the
+    state at the first sample).
+    """
+
+    starts, values = get_word_runs(words)
+    return get_run_edges(starts, values, channels)
+
+def get_word_runs(words):
+    """Run-length encodes packed digital words.
+
+    Returns (starts, values): the sample index at which every run of equal
+    words starts (the first one at 0) and the word of the run.
+    """
+
+    words = np.asarray(words)
+    if len(words) == 0:
+        return np.zeros(0, dtype=np.int64), words[:0]
+    starts = np.concatenate(([0], np.flatnonzero(words[1:] != words[:-1]) + 1))
+    return starts, words[starts]
+
+def get_run_edges(starts, values, channels):
+    """get_digital_edges for words given as runs (see get_word_runs)."""
+
+    changed = starts[1:]
+    before = values[:-1]
+    after = values[1:]
+
+    edges = []
+    for ch in channels:
+        mask = 1 << ch['native_order']
+        was_high = np.bitwise_and(before, mask) != 0
+        is_high = np.bitwise_and(after, mask) != 0
+        edge = {}
+        edge['rising'] = changed[is_high & ~was_high]
+        edge['falling'] = changed[was_high & ~is_high]
+        edge['initial'] = bool(len(values) > 0 and values[0] & mask)
+        edges.append(edge)
+    return edges
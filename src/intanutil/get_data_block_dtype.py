@@ -0,0 +1,66 @@
+#! /bin/env python
+#
+# Structured numpy description of one 60 or 128 sample data block.
+
+import numpy as np
+
+SIGNAL_TYPES = ['amplifier', 'aux_input', 'supply_voltage', 'temp_sensor', 'board_adc', 'board_dig_in', 'board_dig_out']
+
+def get_data_block_dtype(header, signal_types=None):
+    """Builds a numpy structured dtype describing one 60 or 128 sample datablock.
+
+    Fields follow the order in which read_one_data_block reads them, and the
+    total itemsize equals get_bytes_per_data_block(header).  Signal types with
+    no enabled channels are left out of the dtype.
+
+    If signal_types is given (a list of names from SIGNAL_TYPES), only the
+    timestamps and those fields are described; the others become padding, so
+    viewing raw blocks through the dtype never touches the skipped bytes.
+    """
+
+    num_samples = header['num_samples_per_data_block']
+
+    # In version 1.2, we moved from saving timestamps as unsigned
+    # integers to signed integers to accommodate negative (adjusted)
+    # timestamps for pretrigger data.
+    if (header['version']['major'] == 1 and header['version']['minor'] >= 2) or (header['version']['major'] > 1):
+        fields = [('timestamps', '<i4', (num_samples,))]
+    else:
+        fields = [('timestamps', '<u4', (num_samples,))]
+
+    if header['num_amplifier_channels'] > 0:
+        fields.append(('amplifier', '<u2', (header['num_amplifier_channels'], num_samples)))
+
+    # Auxiliary inputs are sampled 4x slower than amplifiers
+    if header['num_aux_input_channels'] > 0:
+        fields.append(('aux_input', '<u2', (header['num_aux_input_channels'], int(num_samples / 4))))
+
+    # Supply voltage and temp sensor are sampled once per block
+    if header['num_supply_voltage_channels'] > 0:
+        fields.append(('supply_voltage', '<u2', (header['num_supply_voltage_channels'],)))
+
+    if header['num_temp_sensor_channels'] > 0:
+        fields.append(('temp_sensor', '<u2', (header['num_temp_sensor_channels'],)))
+
+    if header['num_board_adc_channels'] > 0:
+        fields.append(('board_adc', '<u2', (header['num_board_adc_channels'], num_samples)))
+
+    # All digital channels share one 16-bit word per sample
+    if header['num_board_dig_in_channels'] > 0:
+        fields.append(('board_dig_in', '<u2', (num_samples,)))
+
+    if header['num_board_dig_out_channels'] > 0:
+        fields.append(('board_dig_out', '<u2', (num_samples,)))
+
+    block_dtype = np.dtype(fields)
+    if signal_types is None:
+        return block_dtype
+
+    for name in signal_types:
+        if name not in SIGNAL_TYPES:
+            raise Exception('Unknown signal type: ' + str(name))
+    names = [name for name in block_dtype.names if name == 'timestamps' or name in signal_types]
+    return np.dtype({'names': names,
+                     'formats': [block_dtype.fields[name][0] for name in names],
+                     'offsets': [block_dtype.fields[name][1] for name in names],
+                     'itemsize': block_dtype.itemsize})
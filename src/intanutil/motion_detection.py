@@ -0,0 +1,70 @@
+#! /bin/env python
+#
+# Motion-artifact detection from headstage accelerometer (aux input) data.
+
+import numpy as np
+
+AUX_STEP = 37.4e-6      # volts per aux input count
+
+def detect_motion(aux_data, sample_rate, window=0.5, threshold=5.0, min_spread=AUX_STEP):
+    """Finds high-motion periods in accelerometer data.
+
+    aux_data is a channels x samples array (e.g. the aux_input_data returned
+    by read_data, in volts) and sample_rate its sample rate.  The data are cut
+    into windows of window seconds and every window is scored by the
+    magnitude of its acceleration variation, sqrt(sum of channel variances).
+    Windows scoring more than threshold robust standard deviations
+    (1.4826 * MAD) above the median score are flagged, and runs of flagged
+    windows are merged.  Returns a list of (start, end) times in seconds.
+
+    The spread is at least 5% of the median score and at least min_spread
+    (one aux input count by default), so a still animal or a flat, quantized
+    signal, whose MAD is 0, does not flag every window above the median.
+    With a spread of 0 nothing is flagged.
+    """
+
+    return detect_motion_chunks([aux_data], sample_rate, window, threshold, min_spread)
+
+def detect_motion_chunks(aux_chunks, sample_rate, window=0.5, threshold=5.0, min_spread=AUX_STEP):
+    """detect_motion for accelerometer data given as consecutive chunks.
+
+    aux_chunks yields channels x samples arrays that together make up the
+    recording.  Only the window scores and one partial window are kept, so
+    memory does not depend on the recording length; the result is the same
+    as detect_motion on the concatenated data.
+    """
+
+    window_samples = max(2, int(round(window * sample_rate)))
+    num_channels = 0
+    num_samples = 0
+    pending = None
+    scores = []
+    for chunk in aux_chunks:
+        chunk = np.asarray(chunk)
+        num_channels = chunk.shape[0]
+        num_samples += chunk.shape[1]
+        pending = chunk if pending is None else np.concatenate((pending, chunk), axis=1)
+        num_windows = pending.shape[1] // window_samples
+        if num_windows > 0:
+            windows = pending[:, :num_windows * window_samples].reshape(num_channels, num_windows, window_samples)
+            scores.append(np.sqrt(windows.var(axis=2).sum(axis=0)))
+            pending = pending[:, num_windows * window_samples:]
+    if num_channels == 0 or num_samples < 2:
+        return []
+    if pending.shape[1] >= 2:
+        # Trailing partial window.
+        scores.append(np.sqrt(pending.var(axis=1).sum(axis=0, keepdims=True)))
+    scores = np.concatenate(scores)
+
+    median = np.median(scores)
+    spread = max(1.4826 * np.median(np.abs(scores - median)), 0.05 * median, min_spread)
+    if spread <= 0:
+        return []
+    flagged = scores > median + threshold * spread
+
+    # Merge runs of flagged windows into (start, end) periods.
+    edges = np.diff(np.concatenate(([0], flagged.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return [(float(start * window_samples / sample_rate), float(min(end * window_samples, num_samples) / sample_rate))
+            for start, end in zip(starts, ends)]
@@ -48,3 +48,124 @@ def notch_filter(input, fSample, fNotch, Bandwidth):
         out[i] = (a*b2*input[i-2] + a*b1*input[i-1] + a*b0*input[i] - a2*out[i-2] - a1*out[i-1])/a0
 
     return out
+
+def notch_filter_chunk(input, fSample, fNotch, Bandwidth, state=None, block_size=128):
+    """Vectorized notch_filter for all channels of a (channels x samples) array.
+
+    Implements the same IIR notch as notch_filter, but filters every channel
+    at once and returns (out, state).  Passing state back in with the next
+    chunk (of this stream, or of the next RHD file) continues the filter
+    without an edge transient.  With state=None the filter starts like
+    notch_filter does, passing the first two samples through.
+
+    The recursion is solved block_size samples at a time: the zero-state
+    response of every block is computed in parallel, then the two-sample
+    filter state is carried from block to block.  Output does not depend on
+    how a stream is cut into chunks, as long as every cut falls on a multiple
+    of block_size samples from the start of the stream.
+
+    Example:
+        out1, state = notch_filter_chunk(chunk1, 30000, 60, 10)
+        out2, state = notch_filter_chunk(chunk2, 30000, 60, 10, state)
+    """
+
+    if block_size < 2:
+        raise Exception('block_size must be at least 2.')
+
+    tstep = 1.0/fSample
+    Fc = fNotch*tstep
+
+    # Calculate IIR filter parameters
+    d = math.exp(-2.0*math.pi*(Bandwidth/2.0)*tstep)
+    b = (1.0 + d*d) * math.cos(2.0*math.pi*Fc)
+    a1 = -b
+    a2 = d*d
+    a = (1.0 + d*d)/2.0
+    b0 = 1.0
+    b1 = -2.0 * math.cos(2.0*math.pi*Fc)
+    b2 = 1.0
+
+    x = np.asarray(input, dtype=np.float64)
+    one_channel = x.ndim == 1
+    if one_channel:
+        x = x[np.newaxis, :]
+    num_channels, L = x.shape
+
+    num_blocks = -(-L // block_size)
+    out = np.zeros((num_channels, num_blocks*block_size))
+    start = 0
+
+    if state is None and L > 0:
+        # Run the first block sample by sample, exactly as notch_filter does.
+        start = min(block_size, L)
+        out[:, :2] = x[:, :2]
+        for i in range(2, start):
+            out[:, i] = a*b2*x[:, i-2] + a*b1*x[:, i-1] + a*b0*x[:, i] - a2*out[:, i-2] - a1*out[:, i-1]
+        x_hist = np.concatenate((x[:, :1], x[:, :start]), axis=1)
+        y_hist = np.concatenate((out[:, :1], out[:, :start]), axis=1)
+        state = {'x': x_hist[:, :-3:-1].copy(), 'y': y_hist[:, :-3:-1].copy()}
+    if state is None or start == L:
+        out = out[:, :L]
+        return (out[0] if one_channel else out), state
+
+    # Non-recursive part, using the two previous input samples.
+    f = out[:, start:]
+    n = L - start
+    x_prev = np.concatenate((state['x'][:, ::-1], x[:, start:start+2]), axis=1)    # x[start-2] .. x[start+1]
+    m = min(n, 2)
+    tmp = np.empty((num_channels, n))
+    np.multiply(a*b0, x[:, start:], out=f[:, :n])
+    np.multiply(a*b1, x_prev[:, 1:m+1], out=tmp[:, :m])
+    np.multiply(a*b1, x[:, start+1:L-1], out=tmp[:, 2:])
+    f[:, :n] += tmp
+    np.multiply(a*b2, x_prev[:, :m], out=tmp[:, :m])
+    np.multiply(a*b2, x[:, start:L-2], out=tmp[:, 2:])
+    f[:, :n] += tmp
+    del tmp
+
+    # Zero-state response of every block, all blocks and channels at once.
+    # Blocks are laid out along the last axis so every step of the
+    # recursion is one contiguous vector operation.
+    blocks = out.reshape(num_channels, num_blocks, block_size)[:, start // block_size:]
+    z = blocks.transpose(2, 0, 1).copy()
+    z[1] -= a1*z[0]
+    for i in range(2, block_size):
+        z[i] -= a1*z[i-1]
+        z[i] -= a2*z[i-2]
+
+    # Response of one block to unit previous outputs y[-1] (g1) and y[-2] (g2).
+    g1 = np.zeros(block_size + 2)
+    g2 = np.zeros(block_size + 2)
+    g1[1] = 1.0
+    g2[0] = 1.0
+    for i in range(2, block_size + 2):
+        g1[i] = -a1*g1[i-1] - a2*g1[i-2]
+        g2[i] = -a1*g2[i-1] - a2*g2[i-2]
+    g1 = g1[2:]
+    g2 = g2[2:]
+
+    # Carry the previous two outputs from block to block.
+    p1 = np.empty(z.shape[1:])
+    p2 = np.empty(z.shape[1:])
+    y1 = state['y'][:, 0]
+    y2 = state['y'][:, 1]
+    for k in range(z.shape[2]):
+        p1[:, k] = y1
+        p2[:, k] = y2
+        y1 = (z[-1, :, k] + g1[-1]*p1[:, k]) + g2[-1]*p2[:, k]
+        y2 = (z[-2, :, k] + g1[-2]*p1[:, k]) + g2[-2]*p2[:, k]
+    for i in range(block_size):
+        z[i] += g1[i]*p1
+        z[i] += g2[i]*p2
+    blocks[...] = z.transpose(1, 2, 0)
+    del z
+
+    # Last two inputs and outputs, most recent first.
+    out = out[:, :L]
+    x_hist = np.concatenate((state['x'][:, ::-1], x[:, -2:]), axis=1)
+    y_hist = np.concatenate((state['y'][:, ::-1], out[:, -2:]), axis=1)
+    state = {'x': x_hist[:, :-3:-1].copy(), 'y': y_hist[:, :-3:-1].copy()}
+
+    if one_channel:
+        out = out[0]
+    return out, state
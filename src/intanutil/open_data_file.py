@@ -0,0 +1,24 @@
+#! /bin/env python
+#
+# Opens plain or compressed (.gz, .bz2, .xz) RHD2000 data files.
+
+import gzip, bz2, lzma
+
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+def is_compressed(filename):
+    """True if filename ends with one of the supported compression extensions."""
+    return any(filename.lower().endswith(ext) for ext in COMPRESSED_OPENERS)
+
+def open_data_file(filename):
+    """Opens filename for binary reading, decompressing on the fly if needed.
+
+    Compressed files are decoded as a stream with bounded buffers; their
+    uncompressed size is not known in advance, so readers must read them
+    until the end instead of relying on os.path.getsize.
+    """
+
+    for ext, opener in COMPRESSED_OPENERS.items():
+        if filename.lower().endswith(ext):
+            return opener(filename, 'rb')
+    return open(filename, 'rb')
@@ -3,7 +3,7 @@
 # Michael Gibson 23 April 2015
 
 
-import sys, struct, os
+import sys, struct
 
 def read_qstring(fid):
     """Read Qt style QString.  
@@ -17,24 +17,13 @@ def read_qstring(fid):
     length, = struct.unpack('<I', fid.read(4))
     if length == int('ffffffff', 16): return ""
 
-    if length > (os.fstat(fid.fileno()).st_size - fid.tell() + 1) :
+    # Read all 16-bit Unicode words at once and decode them in bulk.
+    data = fid.read(2 * int(length / 2))
+    if len(data) != 2 * int(length / 2):
         print(length)
         raise Exception('Length too long.')
 
-    # convert length from bytes to 16-bit Unicode words
-    length = int(length / 2)
-
-    data = []
-    for i in range(0, length):
-        c, = struct.unpack('<H', fid.read(2))
-        data.append(c)
-
-    if sys.version_info >= (3,0):
-        a = ''.join([chr(c) for c in data])
-    else:
-        a = ''.join([unichr(c) for c in data])
-    
-    return a
+    return data.decode('utf-16-le', 'surrogatepass')
   
 if __name__ == '__main__':
     a=read_qstring(open(sys.argv[1], 'rb'))
@@ -0,0 +1,108 @@
+#! /bin/env python
+#
+# Bulk replacement for calling read_one_data_block once per block.
+
+import io
+import numpy as np
+
+from intanutil.get_data_block_dtype import get_data_block_dtype
+
+def read_all_data_blocks(header, num_data_blocks, fid, signal_types=None, amplifier_channels=None, bytes_per_chunk=64 * 1024 * 1024):
+    """Reads num_data_blocks data blocks from fid in a few large reads.
+
+    Returns a dictionary holding the same raw (unscaled) arrays that
+    read_one_data_block fills in block by block.  Blocks are read
+    bytes_per_chunk at a time through a structured dtype, and only the
+    timestamps, the requested signal_types (default: all) and the requested
+    amplifier_channels (indices into header['amplifier_channels'], default:
+    all) are copied out and allocated.
+
+    If num_data_blocks is None, blocks are read until the end of fid, for
+    streams whose length is not known in advance.  The parts read are then
+    joined at the end, which takes about twice the memory of the result;
+    read_data gets the block count of compressed files from their index
+    (see rhd_index) to avoid this.
+    """
+
+    if num_data_blocks is None:
+        blocks_per_chunk = max(1, int(bytes_per_chunk // get_data_block_dtype(header).itemsize))
+        parts = list(iter_data_blocks(header, fid, blocks_per_chunk, None, signal_types, amplifier_channels))
+        if not parts:
+            return read_all_data_blocks(header, 0, fid, signal_types, amplifier_channels)
+        return {key: np.concatenate([part[key] for part in parts], axis=-1) for key in parts[0]}
+
+    num_samples = header['num_samples_per_data_block']
+    block_dtype = get_data_block_dtype(header, signal_types)
+    if amplifier_channels is None:
+        amplifier_channels = slice(None)
+
+    # Output array and samples per block for each field, in (channels, samples) layout.
+    data = {}
+    layout = {}
+    def allocate(key, name, num_channels, samples_per_block):
+        # num_channels is None for the 1-D digital word streams
+        if signal_types is not None and name not in signal_types:
+            return
+        shape = [samples_per_block * num_data_blocks]
+        if num_channels is not None:
+            shape.insert(0, num_channels)
+        data[key] = np.zeros(shape, dtype=np.uint16)
+        if name in block_dtype.names:
+            layout[name] = (key, samples_per_block)
+
+    data['t_amplifier'] = np.zeros(num_samples * num_data_blocks, dtype=block_dtype['timestamps'].base)
+    layout['timestamps'] = ('t_amplifier', num_samples)
+    allocate('amplifier_data', 'amplifier', len(np.arange(header['num_amplifier_channels'])[amplifier_channels]), num_samples)
+    allocate('aux_input_data', 'aux_input', header['num_aux_input_channels'], int(num_samples / 4))
+    allocate('supply_voltage_data', 'supply_voltage', header['num_supply_voltage_channels'], 1)
+    allocate('temp_sensor_data', 'temp_sensor', header['num_temp_sensor_channels'], 1)
+    allocate('board_adc_data', 'board_adc', header['num_board_adc_channels'], num_samples)
+    allocate('board_dig_in_raw', 'board_dig_in', None, num_samples)
+    allocate('board_dig_out_raw', 'board_dig_out', None, num_samples)
+
+    blocks_per_chunk = max(1, int(bytes_per_chunk // block_dtype.itemsize))
+    for first_block in range(0, num_data_blocks, blocks_per_chunk):
+        n = min(blocks_per_chunk, num_data_blocks - first_block)
+        buffer = fid.read(n * block_dtype.itemsize)
+        if len(buffer) != n * block_dtype.itemsize:
+            raise Exception('Error: End of file reached before all data blocks were read.')
+        blocks = np.frombuffer(buffer, dtype=block_dtype)
+
+        for name, (key, samples_per_block) in layout.items():
+            field = blocks[name]
+            if name == 'amplifier':
+                field = field[:, amplifier_channels]
+            start = first_block * samples_per_block
+            end = start + n * samples_per_block
+            if field.ndim == 2 and data[key].ndim == 1:
+                # One word per sample: (blocks, samples) -> (samples)
+                data[key][start:end] = field.reshape(-1)
+            elif field.ndim == 2:
+                # One sample per block: (blocks, channels) -> (channels, blocks)
+                data[key][:, start:end] = field.T
+            else:
+                # (blocks, channels, samples) -> (channels, blocks * samples)
+                data[key][:, start:end] = field.transpose(1, 0, 2).reshape(field.shape[1], -1)
+
+    return data
+
+def iter_data_blocks(header, fid, blocks_per_read, num_data_blocks=None, signal_types=None, amplifier_channels=None):
+    """Yields read_all_data_blocks results for successive groups of blocks_per_read blocks.
+
+    Reading stops after num_data_blocks blocks or, if it is None, at the end
+    of fid, which must then fall on a block boundary.
+    """
+
+    bytes_per_block = get_data_block_dtype(header).itemsize
+    while num_data_blocks is None or num_data_blocks > 0:
+        if num_data_blocks is not None:
+            n = min(blocks_per_read, num_data_blocks)
+            yield read_all_data_blocks(header, n, fid, signal_types, amplifier_channels)
+            num_data_blocks -= n
+            continue
+        buffer = fid.read(blocks_per_read * bytes_per_block)
+        if len(buffer) % bytes_per_block != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+        if len(buffer) == 0:
+            return
+        yield read_all_data_blocks(header, len(buffer) // bytes_per_block, io.BytesIO(buffer), signal_types, amplifier_channels)
@@ -0,0 +1,143 @@
+#! /bin/env python
+#
+# Persistent sidecar index for RHD2000 data files.
+#
+# For every data file a small JSON file (<name>.idx) is kept next to it with
+# the parsed header, the block layout, the gap-free spans of blocks and the
+# positions of timestamp gaps.  find_blocks uses the spans to map a time
+# window to byte offsets without reading the data.  The index is keyed by file size and
+# modification time, so unchanged files are never parsed twice.
+
+import sys, os, json
+import numpy as np
+
+from intanutil.scan_header import scan_header, scan_stream
+from intanutil.open_data_file import is_compressed
+from intanutil.get_data_block_dtype import get_data_block_dtype
+
+INDEX_EXTENSION = '.idx'
+INDEX_VERSION = 2
+
+def index_path(filename):
+    return filename + INDEX_EXTENSION
+
+def build_index(filename):
+    """Scans filename and returns its index as a dictionary.
+
+    On top of the scan_header summary the index holds the file size and
+    mtime it was built from, the timestamp gaps as a list of [sample index,
+    jump in samples] pairs and the spans of blocks whose timestamps run on
+    without a gap, as [first block, number of blocks, first timestamp, last
+    timestamp] lists (see block_spans).
+    """
+
+    stat = os.stat(filename)
+    if is_compressed(filename):
+        # Offsets of compressed files are counted in the uncompressed stream.
+        index, timestamps = scan_stream(filename)
+    else:
+        index = scan_header(filename)
+        timestamps = None
+    index['index_version'] = INDEX_VERSION
+    index['size'] = stat.st_size
+    index['mtime'] = stat.st_mtime_ns
+
+    spans = []
+    gaps = []
+    if index['num_data_blocks'] > 0:
+        if timestamps is None:
+            # Only the timestamp field of each block is paged in.
+            blocks = np.memmap(filename, dtype=get_data_block_dtype(index['header'], []), mode='r',
+                               offset=index['data_offset'], shape=(index['num_data_blocks'],))
+            timestamps = np.asarray(blocks['timestamps'], dtype=np.int64).reshape(-1)
+            del blocks
+        steps = np.diff(timestamps)
+        jumps = np.flatnonzero(steps != 1)
+        gaps = [[int(i) + 1, int(steps[i])] for i in jumps]
+        spans = block_spans(timestamps, index['header']['num_samples_per_data_block'])
+    index['spans'] = spans
+    index['gaps'] = gaps
+    return index
+
+def is_index_current(index, filename):
+    """True if index was built from the current contents of filename."""
+    stat = os.stat(filename)
+    return (index.get('index_version') == INDEX_VERSION and index.get('size') == stat.st_size
+            and index.get('mtime') == stat.st_mtime_ns)
+
+def load_index(filename):
+    """Returns the index of filename, rebuilding and saving it when stale.
+
+    A missing, unreadable or outdated sidecar file is rebuilt.  Failing to
+    write the sidecar (e.g. on read-only media) is not an error.
+    """
+
+    path = index_path(filename)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if is_index_current(index, filename):
+            index['filename'] = filename
+            return index
+    except (OSError, ValueError):
+        pass
+
+    index = build_index(filename)
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+    except OSError:
+        pass
+    return index
+
+def block_spans(timestamps, samples_per_block):
+    """Splits the blocks of a file into runs whose timestamps go up by one sample throughout.
+
+    Returns [first block, number of blocks, first timestamp, last timestamp]
+    lists.  A block with a jump inside it is a span of its own, with the
+    lowest and highest of its timestamps.
+    """
+
+    blocks = np.asarray(timestamps, dtype=np.int64).reshape(-1, samples_per_block)
+    regular = (np.diff(blocks, axis=1) == 1).all(axis=1)
+    joined = regular[1:] & regular[:-1] & (blocks[1:, 0] == blocks[:-1, -1] + 1)
+    starts = np.concatenate(([0], np.flatnonzero(~joined) + 1))
+    ends = np.append(starts[1:], len(blocks))
+    spans = []
+    for start, end in zip(starts, ends):
+        if regular[start]:
+            spans.append([int(start), int(end - start), int(blocks[start, 0]), int(blocks[end - 1, -1])])
+        else:
+            spans.append([int(start), 1, int(blocks[start].min()), int(blocks[start].max())])
+    return spans
+
+def find_blocks(index, start_timestamp, end_timestamp):
+    """Finds the blocks holding timestamps in [start_timestamp, end_timestamp).
+
+    Timestamps are in samples, as stored in the file.  Each span of the
+    index is searched on its own, so files whose timestamps jump back are
+    handled too.  Returns (byte offset, first block, number of blocks) runs
+    in file order, found from the index alone, so a reader can seek straight
+    to them.  Blocks with a jump inside may hold samples outside the window.
+    """
+
+    spb = index['header']['num_samples_per_data_block']
+    runs = []
+    for first_block, num_blocks, first_timestamp, last_timestamp in index['spans']:
+        if end_timestamp <= first_timestamp or start_timestamp > last_timestamp:
+            continue
+        first = max(0, (start_timestamp - first_timestamp) // spb) if num_blocks > 1 else 0
+        last = min(num_blocks, -(-(end_timestamp - first_timestamp) // spb)) if num_blocks > 1 else 1
+        first += first_block
+        last += first_block
+        if len(runs) and runs[-1][1] + runs[-1][2] == first:
+            runs[-1][2] = last - runs[-1][1]
+        else:
+            runs.append([index['data_offset'] + first * index['bytes_per_block'], first, last - first])
+    return [tuple(run) for run in runs]
+
+if __name__ == '__main__':
+    for filename in sys.argv[1:]:
+        index = load_index(filename)
+        print('{0}: {1} blocks, timestamps {2}..{3}, {4} gaps'.format(
+            filename, index['num_data_blocks'], index['first_timestamp'], index['last_timestamp'], len(index['gaps'])))
@@ -0,0 +1,126 @@
+#! /bin/env python
+#
+# Header-only scan of RHD2000 data files.
+
+import sys, os, io, struct
+import numpy as np
+
+from intanutil.read_header import read_header
+from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
+from intanutil.read_all_data_blocks import iter_data_blocks
+from intanutil.open_data_file import open_data_file, is_compressed
+
+def read_header_buffered(fid, initial_size=65536):
+    """Reads the Intan header from fid using one buffered read.
+
+    The first initial_size bytes are parsed in memory with read_header; the
+    buffer is only grown and parsed again for headers that do not fit.
+    Returns (header, data_offset) and leaves fid positioned at data_offset.
+    """
+
+    start = fid.tell()
+    size = initial_size
+    while True:
+        fid.seek(start)
+        buffer = fid.read(size)
+        bio = io.BytesIO(buffer)
+        try:
+            header = read_header(bio)
+            break
+        except Exception as e:
+            # A header longer than the buffer shows up as a short read; a bad
+            # magic number, or a buffer already holding the whole file, is a
+            # real error.
+            if len(buffer) < size or str(e) == 'Unrecognized file type.':
+                raise
+            size *= 4
+    data_offset = start + bio.tell()
+    fid.seek(data_offset)
+    return header, data_offset
+
+def scan_header(filename):
+    """Summarizes one RHD file from its header and two timestamps.
+
+    Returns a dictionary with the parsed header, the sample rate, the number
+    of amplifier channels, the data offset and block layout, the number of
+    data blocks and samples, and the first and last timestamps (in samples;
+    None for a file without data).  No sample data is decoded, except that
+    compressed files are decompressed once to count their blocks.
+    """
+
+    if is_compressed(filename):
+        return scan_stream(filename)[0]
+
+    filesize = os.path.getsize(filename)
+    with open(filename, 'rb') as fid:
+        header, data_offset = read_header_buffered(fid)
+
+        bytes_per_block = int(get_bytes_per_data_block(header))
+        bytes_remaining = filesize - data_offset
+        if bytes_remaining % bytes_per_block != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+        num_data_blocks = bytes_remaining // bytes_per_block
+        num_samples = header['num_samples_per_data_block'] * num_data_blocks
+
+        # Timestamps are the first field of every block.
+        if (header['version']['major'] == 1 and header['version']['minor'] >= 2) or (header['version']['major'] > 1):
+            timestamp_format = '<i'
+        else:
+            timestamp_format = '<I'
+        first_timestamp = None
+        last_timestamp = None
+        if num_data_blocks > 0:
+            fid.seek(data_offset)
+            first_timestamp, = struct.unpack(timestamp_format, fid.read(4))
+            fid.seek(data_offset + (num_data_blocks - 1) * bytes_per_block + 4 * (header['num_samples_per_data_block'] - 1))
+            last_timestamp, = struct.unpack(timestamp_format, fid.read(4))
+
+    return summarize(filename, header, data_offset, bytes_per_block, num_data_blocks, first_timestamp, last_timestamp)
+
+def scan_stream(filename, blocks_per_read=1024):
+    """Scans a (compressed) RHD file as a stream, reading only its timestamps.
+
+    Returns (info, timestamps): the scan_header summary, with offsets counted
+    in the uncompressed stream, and all sample timestamps as int64.
+    """
+
+    with open_data_file(filename) as fid:
+        header, data_offset = read_header_buffered(fid)
+        parts = [data['t_amplifier'] for data in iter_data_blocks(header, fid, blocks_per_read, None, [])]
+    timestamps = np.concatenate(parts).astype(np.int64) if parts else np.zeros(0, dtype=np.int64)
+
+    bytes_per_block = int(get_bytes_per_data_block(header))
+    num_data_blocks = len(timestamps) // header['num_samples_per_data_block']
+    first_timestamp = int(timestamps[0]) if len(timestamps) else None
+    last_timestamp = int(timestamps[-1]) if len(timestamps) else None
+    info = summarize(filename, header, data_offset, bytes_per_block, num_data_blocks, first_timestamp, last_timestamp)
+    return info, timestamps
+
+def summarize(filename, header, data_offset, bytes_per_block, num_data_blocks, first_timestamp, last_timestamp):
+    info = {}
+    info['filename'] = filename
+    info['header'] = header
+    info['sample_rate'] = header['sample_rate']
+    info['num_amplifier_channels'] = header['num_amplifier_channels']
+    info['data_offset'] = data_offset
+    info['bytes_per_block'] = bytes_per_block
+    info['num_data_blocks'] = num_data_blocks
+    info['num_samples'] = header['num_samples_per_data_block'] * num_data_blocks
+    info['first_timestamp'] = first_timestamp
+    info['last_timestamp'] = last_timestamp
+    return info
+
+def scan_folder(folder, extension='.rhd'):
+    """Runs scan_header on every file in folder whose name contains extension.
+
+    Returns the summaries sorted by file name.
+    """
+
+    names = sorted(name for name in os.listdir(folder) if extension in name and not name.endswith('.idx'))
+    return [scan_header(os.path.join(folder, name)) for name in names]
+
+if __name__ == '__main__':
+    for info in scan_folder(sys.argv[1]):
+        print('{0}: {1} Hz, {2} channels, {3} blocks, timestamps {4}..{5}'.format(
+            info['filename'], info['sample_rate'], info['num_amplifier_channels'],
+            info['num_data_blocks'], info['first_timestamp'], info['last_timestamp']))
@@ -0,0 +1,90 @@
+#! /bin/env python
+#
+# Sorted, merged sets of time intervals, used for cropping noise segments.
+
+import re, math
+import numpy as np
+
+class IntervalSet:
+    """Set of time intervals [start, end) in seconds, kept sorted and merged.
+
+    Bounds may be fractional; an end of 'end', '$' or None (stored as
+    math.inf) runs to the end of the data.  Overlapping or touching
+    intervals are merged as they are added, so the cost of cropping scales
+    with the number of intervals, not with the number of samples.
+    """
+
+    def __init__(self, intervals=()):
+        self.intervals = []
+        for start, end in intervals:
+            self.add(start, end)
+
+    def add(self, start, end):
+        if end in ('end', '$', None):
+            end = math.inf
+        start = float(start)
+        end = float(end)
+        if start < 0 or not end > start:
+            raise Exception('Invalid interval ({0}, {1}).'.format(start, end))
+        merged = []
+        for s, e in self.intervals:
+            if e < start or s > end:
+                merged.append((s, e))
+            else:
+                start = min(start, s)
+                end = max(end, e)
+        merged.append((start, end))
+        merged.sort()
+        self.intervals = merged
+
+    def __iter__(self):
+        return iter(self.intervals)
+
+    def __len__(self):
+        return len(self.intervals)
+
+    @classmethod
+    def parse(cls, text):
+        """Parses '(a,b);(c,$)' where a, b, c are (fractional) seconds and $ is the end."""
+        number = r'\d+(?:\.\d*)?|\.\d+'
+        pattern = re.compile(r'^\((?P<start>' + number + r'),(?P<end>' + number + r'|\$)\)$')
+        result = cls()
+        for s in text.replace(' ', '').replace('\n', '').replace('\r', '').split(';'):
+            reobj = pattern.search(s)
+            if not reobj:
+                raise Exception('Invalid interval string: ' + s)
+            result.add(reobj.group('start'), reobj.group('end'))
+        return result
+
+    def sample_ranges(self, sample_rate, length):
+        """Returns the intervals as merged (start, end) sample index ranges within [0, length)."""
+        ranges = []
+        for start, end in self.intervals:
+            start = min(int(round(start * sample_rate)), length)
+            end = length if math.isinf(end) else min(int(round(end * sample_rate)), length)
+            if end <= start:
+                continue
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], max(end, ranges[-1][1]))
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    def complement_ranges(self, sample_rate, length):
+        """Returns the (start, end) sample index ranges within [0, length) not covered by the set."""
+        ranges = []
+        pos = 0
+        for start, end in self.sample_ranges(sample_rate, length):
+            if start > pos:
+                ranges.append((pos, start))
+            pos = end
+        if pos < length:
+            ranges.append((pos, length))
+        return ranges
+
+    def mask(self, sample_rate, length):
+        """Boolean mask over length samples, True inside the set."""
+        mask = np.zeros(length, dtype=bool)
+        for start, end in self.sample_ranges(sample_rate, length):
+            mask[start:end] = True
+        return mask
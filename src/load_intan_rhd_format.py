@@ -8,95 +8,85 @@ import numpy as np
 
 from intanutil.read_header import read_header
 from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
-from intanutil.read_one_data_block import read_one_data_block
-from intanutil.notch_filter import notch_filter
+from intanutil.read_all_data_blocks import read_all_data_blocks, iter_data_blocks
+from intanutil.open_data_file import open_data_file, is_compressed
+from intanutil.rhd_index import load_index
+from intanutil.notch_filter import notch_filter_chunk
 from intanutil.data_to_result import data_to_result
+from intanutil.digital_channels import extract_digital_channels
+from intan_dat_file import IntanDatFile
 
 
-def read_data(filename):
+def read_data(filename, signal_types=None, amplifier_channels=None, raw=False):
     """Reads Intan Technologies RHD2000 data file generated by evaluation board GUI.
     
     Data are returned in a dictionary, for future extensibility.
+
+    signal_types limits decoding to the listed signal types ('amplifier',
+    'aux_input', 'supply_voltage', 'temp_sensor', 'board_adc', 'board_dig_in',
+    'board_dig_out'); the default decodes all of them.  amplifier_channels is
+    a list of indices into the header's amplifier channels to decode.  Skipped
+    signals and channels are neither parsed nor allocated, and are left out
+    of the result together with their time vectors; t_amplifier (the
+    timestamps) is always decoded.
+
+    If raw is True, amplifier_data is returned as int16 counts together with
+    'amplifier_scale' and 'amplifier_offset' (mV = scale * (counts - offset))
+    instead of float64 mV, a quarter of the memory.  The software notch
+    filter is then left to scale_amplifier_data, and 'amplifier_notch_frequency'
+    says which notch (0 for none) is still to be applied.  Digital inputs and
+    outputs are returned as the packed 16-bit words 'board_dig_in_raw' and
+    'board_dig_out_raw' rather than one bool array per channel.
+
+    Files ending in .gz, .bz2 or .xz are decompressed as a stream while
+    decoding; the result is the same as for the uncompressed file.
     """
 
-    fid = open(filename, 'rb')
-    filesize = os.path.getsize(filename)
+    fid = open_data_file(filename)
 
     header = read_header(fid)
 
     # Determine how many samples the data file contains.
     bytes_per_block = get_bytes_per_data_block(header)
 
-    # How many data blocks remain in this file?
-    data_present = False
-    bytes_remaining = filesize - fid.tell()
-    if bytes_remaining > 0:
-        data_present = True
+    if is_compressed(filename):
+        # The length of a compressed stream is only known once it is decoded;
+        # the index has it (from a timestamps-only pass the first time), so
+        # the arrays are allocated once rather than joined from parts.
+        num_data_blocks = load_index(filename)['num_data_blocks']
+        data = read_all_data_blocks(header, num_data_blocks, fid, signal_types, amplifier_channels)
+        if len(fid.read(1)) != 0: raise Exception('Error: End of file not reached.')
+        data_present = num_data_blocks > 0
+    else:
+        filesize = os.path.getsize(filename)
+
+        # How many data blocks remain in this file?
+        data_present = False
+        bytes_remaining = filesize - fid.tell()
+        if bytes_remaining > 0:
+            data_present = True
 
-    if bytes_remaining % bytes_per_block != 0:
-        raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+        if bytes_remaining % bytes_per_block != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
 
-    num_data_blocks = int(bytes_remaining / bytes_per_block)
+        num_data_blocks = int(bytes_remaining / bytes_per_block)
+
+        if data_present:
+            # Read all data blocks in one pass using a structured block dtype.
+            data = read_all_data_blocks(header, num_data_blocks, fid, signal_types, amplifier_channels)
+
+            # Make sure we have read exactly the right amount of data.
+            bytes_remaining = filesize - fid.tell()
+            if bytes_remaining != 0: raise Exception('Error: End of file not reached.')
 
     num_amplifier_samples = header['num_samples_per_data_block'] * num_data_blocks
-    num_aux_input_samples = int((header['num_samples_per_data_block'] / 4) * num_data_blocks)
-    num_supply_voltage_samples = 1 * num_data_blocks
-    num_board_adc_samples = header['num_samples_per_data_block'] * num_data_blocks
-    num_board_dig_in_samples = header['num_samples_per_data_block'] * num_data_blocks
-    num_board_dig_out_samples = header['num_samples_per_data_block'] * num_data_blocks
 
     record_time = num_amplifier_samples / header['sample_rate']
     sample_rate = header['sample_rate']
 
-    if data_present:
-        # Pre-allocate memory for data.
-        data = {}
-        if (header['version']['major'] == 1 and header['version']['minor'] >= 2) or (header['version']['major'] > 1):
-            data['t_amplifier'] = np.zeros(num_amplifier_samples, dtype=int)
-        else:
-            data['t_amplifier'] = np.zeros(num_amplifier_samples, dtype=np.uint)
-
-        data['amplifier_data'] = np.zeros([header['num_amplifier_channels'], num_amplifier_samples], dtype=np.uint)
-        data['aux_input_data'] = np.zeros([header['num_aux_input_channels'], num_aux_input_samples], dtype=np.uint)
-        data['supply_voltage_data'] = np.zeros([header['num_supply_voltage_channels'], num_supply_voltage_samples], dtype=np.uint)
-        data['temp_sensor_data'] = np.zeros([header['num_temp_sensor_channels'], num_supply_voltage_samples], dtype=np.uint)
-        data['board_adc_data'] = np.zeros([header['num_board_adc_channels'], num_board_adc_samples], dtype=np.uint)
-        
-        # by default, this script interprets digital events (digital inputs and outputs) as booleans
-        # if unsigned int values are preferred(0 for False, 1 for True), replace the 'dtype=np.bool' argument with 'dtype=np.uint' as shown
-        # the commented line below illustrates this for digital input data; the same can be done for digital out
-        
-        #data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=np.uint)
-        data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=bool)
-        data['board_dig_in_raw'] = np.zeros(num_board_dig_in_samples, dtype=np.uint)
-        
-        data['board_dig_out_data'] = np.zeros([header['num_board_dig_out_channels'], num_board_dig_out_samples], dtype=bool)
-        data['board_dig_out_raw'] = np.zeros(num_board_dig_out_samples, dtype=np.uint)
-
-        # Read sampled data from file.
-        # Initialize indices used in looping
-        indices = {}
-        indices['amplifier'] = 0
-        indices['aux_input'] = 0
-        indices['supply_voltage'] = 0
-        indices['board_adc'] = 0
-        indices['board_dig_in'] = 0
-        indices['board_dig_out'] = 0
-
-        for i in range(num_data_blocks):
-            read_one_data_block(data, header, indices, fid)
-
-            # Increment indices
-            indices['amplifier'] += header['num_samples_per_data_block']
-            indices['aux_input'] += int(header['num_samples_per_data_block'] / 4)
-            indices['supply_voltage'] += 1
-            indices['board_adc'] += header['num_samples_per_data_block']
-            indices['board_dig_in'] += header['num_samples_per_data_block']
-            indices['board_dig_out'] += header['num_samples_per_data_block']            
-
-        # Make sure we have read exactly the right amount of data.
-        bytes_remaining = filesize - fid.tell()
-        if bytes_remaining != 0: raise Exception('Error: End of file not reached.')
+    # From here on, the header only describes the decoded amplifier channels.
+    if amplifier_channels is not None:
+        header = select_amplifier_channels(header, amplifier_channels)
 
     # Close data file.
     fid.close()
@@ -104,46 +94,73 @@ def read_data(filename):
     if (data_present):
         #print('Parsing data...')
 
-        # Extract digital input channels to separate variables.
-        for i in range(header['num_board_dig_in_channels']):
-            data['board_dig_in_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_in_raw'], (1 << header['board_dig_in_channels'][i]['native_order'])), 0)
+        # by default, this script interprets digital events (digital inputs and outputs) as booleans;
+        # in raw mode the packed 16-bit words are returned instead (see intanutil.digital_channels)
+
+        # Extract all digital input channels to separate variables in one pass.
+        if 'board_dig_in_raw' in data and not raw:
+            data['board_dig_in_data'] = extract_digital_channels(data['board_dig_in_raw'], header['board_dig_in_channels'])
 
-        # Extract digital output channels to separate variables.
-        for i in range(header['num_board_dig_out_channels']):
-            data['board_dig_out_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_out_raw'], (1 << header['board_dig_out_channels'][i]['native_order'])), 0)
+        # Extract all digital output channels to separate variables in one pass.
+        if 'board_dig_out_raw' in data and not raw:
+            data['board_dig_out_data'] = extract_digital_channels(data['board_dig_out_raw'], header['board_dig_out_channels'])
 
         # Scale voltage levels appropriately.
-        data['amplifier_data'] = np.multiply(0.000195, (data['amplifier_data'].astype(np.int32) - 32768))      # units = mV
-        data['aux_input_data'] = np.multiply(37.4e-6, data['aux_input_data'])               # units = volts
-        data['supply_voltage_data'] = np.multiply(74.8e-6, data['supply_voltage_data'])     # units = volts
-        if header['eval_board_mode'] == 1:
-            data['board_adc_data'] = np.multiply(152.59e-6, (data['board_adc_data'].astype(np.int32) - 32768)) # units = volts
-        elif header['eval_board_mode'] == 13:
-            data['board_adc_data'] = np.multiply(312.5e-6, (data['board_adc_data'].astype(np.int32) - 32768)) # units = volts
-        else:
-            data['board_adc_data'] = np.multiply(50.354e-6, data['board_adc_data'])           # units = volts
-        data['temp_sensor_data'] = np.multiply(0.01, data['temp_sensor_data'])               # units = deg C
+        if 'amplifier_data' in data and raw:
+            # Flipping the sign bit subtracts 32768 in place, giving int16 counts.
+            np.bitwise_xor(data['amplifier_data'], 0x8000, out=data['amplifier_data'])
+            data['amplifier_data'] = data['amplifier_data'].view(np.int16)
+            data['amplifier_scale'] = 0.000195      # units = mV per count
+            data['amplifier_offset'] = 0
+        elif 'amplifier_data' in data:
+            amplifier_data = data['amplifier_data'].astype(np.float64)
+            amplifier_data -= 32768
+            amplifier_data *= 0.000195      # units = mV
+            data['amplifier_data'] = amplifier_data
+        if 'aux_input_data' in data:
+            data['aux_input_data'] = np.multiply(37.4e-6, data['aux_input_data'])               # units = volts
+        if 'supply_voltage_data' in data:
+            data['supply_voltage_data'] = np.multiply(74.8e-6, data['supply_voltage_data'])     # units = volts
+        if 'board_adc_data' in data:
+            if header['eval_board_mode'] == 1:
+                data['board_adc_data'] = np.multiply(152.59e-6, (data['board_adc_data'].astype(np.int32) - 32768)) # units = volts
+            elif header['eval_board_mode'] == 13:
+                data['board_adc_data'] = np.multiply(312.5e-6, (data['board_adc_data'].astype(np.int32) - 32768)) # units = volts
+            else:
+                data['board_adc_data'] = np.multiply(50.354e-6, data['board_adc_data'])           # units = volts
+        if 'temp_sensor_data' in data:
+            data['temp_sensor_data'] = np.multiply(0.01, data['temp_sensor_data'])               # units = deg C
 
         # Check for gaps in timestamps.
         num_gaps = np.sum(np.not_equal(data['t_amplifier'][1:]-data['t_amplifier'][:-1], 1))
         if not num_gaps == 0:
             print('Warning: {0} gaps in timestamp data found.  Time scale will not be uniform!'.format(num_gaps))
 
-        # Scale time steps (units = seconds).
+        # Scale time steps (units = seconds); only for the decoded signal types.
         data['t_amplifier'] = data['t_amplifier'] / header['sample_rate']
-        data['t_aux_input'] = data['t_amplifier'][range(0, len(data['t_amplifier']), 4)]
-        data['t_supply_voltage'] = data['t_amplifier'][range(0, len(data['t_amplifier']), header['num_samples_per_data_block'])]
-        data['t_board_adc'] = data['t_amplifier']
-        data['t_dig'] = data['t_amplifier']
-        data['t_temp_sensor'] = data['t_supply_voltage']
+        decoded = lambda name: signal_types is None or name in signal_types
+        if decoded('aux_input'):
+            data['t_aux_input'] = data['t_amplifier'][range(0, len(data['t_amplifier']), 4)]
+        if decoded('supply_voltage'):
+            data['t_supply_voltage'] = data['t_amplifier'][range(0, len(data['t_amplifier']), header['num_samples_per_data_block'])]
+        if decoded('temp_sensor'):
+            data['t_temp_sensor'] = data['t_amplifier'][range(0, len(data['t_amplifier']), header['num_samples_per_data_block'])]
+        if decoded('board_adc'):
+            data['t_board_adc'] = data['t_amplifier']
+        if decoded('board_dig_in') or decoded('board_dig_out'):
+            data['t_dig'] = data['t_amplifier']
 
         # If the software notch filter was selected during the recording, apply the
         # same notch filter to amplifier data here.
-        if header['notch_filter_frequency'] > 0 and header['version']['major'] < 3:
+        if raw:
+            data['amplifier_notch_frequency'] = 0
+            if header['notch_filter_frequency'] > 0 and header['version']['major'] < 3:
+                data['amplifier_notch_frequency'] = header['notch_filter_frequency']
+        elif header['notch_filter_frequency'] > 0 and header['version']['major'] < 3 and 'amplifier_data' in data:
             print('Applying notch filter...')
 
-            for i in range(header['num_amplifier_channels']):
-                data['amplifier_data'][i,:] = notch_filter(data['amplifier_data'][i,:], header['sample_rate'], header['notch_filter_frequency'], 10)
+            data['amplifier_data'] = notch_filter_chunk(data['amplifier_data'], header['sample_rate'], header['notch_filter_frequency'], 10,
+                                                        block_size=header['num_samples_per_data_block'])[0]
 
     else:
         data = []
@@ -153,6 +170,180 @@ def read_data(filename):
 
     return result, record_time, sample_rate
 
+def read_data_chunks(filenames, chunk_duration=10, amplifier_channels=None, chunk_samples=None):
+    """Generator reading amplifier data in fixed-duration chunks.
+
+    filenames is one RHD file or an ordered list of RHD files making up a
+    continuous recording; one-file-per-signal-type folders (see
+    intan_dat_file) may be given as well.  Each yielded dictionary holds a
+    chunk of chunk_duration seconds (or chunk_samples samples, if given; the
+    last one may be shorter) spanning file boundaries as needed:
+        'amplifier_data'  channels x samples, float64 mV, as in read_data
+        't_amplifier'     timestamps in seconds
+        'sample_offset'   index of the chunk's first sample in the recording
+        'sample_rate'     sample rate in Hz
+    Only amplifier data are decoded, so memory stays bounded by a few chunks
+    however long the recording is.  If the software notch filter was on, it
+    is applied with its state carried across chunks and files.
+    """
+
+    if isinstance(filenames, str):
+        filenames = [filenames]
+
+    pending_data = []
+    pending_t = []
+    num_pending = 0
+    sample_offset = 0
+    sample_rate = None
+    num_channels = None
+    notch_state = None
+
+    for filename in filenames:
+        reader = DataBlockReader(filename)
+        header = reader.header
+        samples_per_block = header['num_samples_per_data_block']
+
+        if sample_rate is None:
+            sample_rate = header['sample_rate']
+            if chunk_samples is None:
+                chunk_samples = max(1, int(round(chunk_duration * sample_rate)))
+        elif header['sample_rate'] != sample_rate:
+            reader.close()
+            raise Exception('Sample rate of ' + filename + ' differs from the previous files.')
+        if amplifier_channels is not None:
+            header = select_amplifier_channels(header, amplifier_channels)
+        if num_channels is None:
+            num_channels = header['num_amplifier_channels']
+        elif header['num_amplifier_channels'] != num_channels:
+            reader.close()
+            raise Exception('Number of amplifier channels of ' + filename + ' differs from the previous files.')
+
+        notch_frequency = 0
+        if header['notch_filter_frequency'] > 0 and header['version']['major'] < 3:
+            notch_frequency = header['notch_filter_frequency']
+        else:
+            notch_state = None
+
+        # Read whole data blocks, enough for about one chunk at a time.
+        blocks_per_read = max(1, -(-chunk_samples // samples_per_block))
+        for data in reader.blocks(blocks_per_read, ['amplifier'], amplifier_channels):
+            amplifier_data = data['amplifier_data'].astype(np.float64)
+            amplifier_data -= 32768
+            amplifier_data *= 0.000195      # units = mV
+            if notch_frequency > 0:
+                amplifier_data, notch_state = notch_filter_chunk(amplifier_data, sample_rate, notch_frequency, 10, notch_state,
+                                                                 block_size=samples_per_block)
+            pending_data.append(amplifier_data)
+            pending_t.append(data['t_amplifier'] / sample_rate)
+            num_pending += amplifier_data.shape[1]
+
+            while num_pending >= chunk_samples:
+                chunk_data = np.concatenate(pending_data, axis=1)
+                chunk_t = np.concatenate(pending_t)
+                yield {'amplifier_data': chunk_data[:, :chunk_samples], 't_amplifier': chunk_t[:chunk_samples],
+                       'sample_offset': sample_offset, 'sample_rate': sample_rate}
+                sample_offset += chunk_samples
+                pending_data = [chunk_data[:, chunk_samples:]]
+                pending_t = [chunk_t[chunk_samples:]]
+                num_pending -= chunk_samples
+
+        reader.close()
+
+    if num_pending > 0:
+        yield {'amplifier_data': np.concatenate(pending_data, axis=1), 't_amplifier': np.concatenate(pending_t),
+               'sample_offset': sample_offset, 'sample_rate': sample_rate}
+
+class DataBlockReader:
+    """Block-wise reader for an RHD data file or a one-file-per-signal-type folder.
+
+    The header is parsed when the reader is created.  blocks() then yields,
+    for successive groups of blocks_per_read data blocks, the raw (unscaled)
+    arrays returned by read_all_data_blocks, whatever the storage format:
+    plain or compressed .rhd files, or info.rhd + *.dat folders.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fid = None
+        self.dat = None
+        if os.path.isdir(filename):
+            self.dat = IntanDatFile(filename)
+            self.header = self.dat.header
+            return
+        self.fid = open_data_file(filename)
+        self.header = read_header(self.fid)
+        self.num_data_blocks = None
+        if not is_compressed(filename):
+            # Compressed streams are read until they end.
+            bytes_per_block = get_bytes_per_data_block(self.header)
+            bytes_remaining = os.path.getsize(filename) - self.fid.tell()
+            if bytes_remaining % bytes_per_block != 0:
+                self.close()
+                raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+            self.num_data_blocks = int(bytes_remaining / bytes_per_block)
+
+    def blocks(self, blocks_per_read, signal_types=None, amplifier_channels=None):
+        if self.fid is not None:
+            yield from iter_data_blocks(self.header, self.fid, blocks_per_read, self.num_data_blocks, signal_types, amplifier_channels)
+            return
+
+        dat = self.dat
+        if amplifier_channels is None:
+            amplifier_channels = slice(None)
+        samples_per_read = blocks_per_read * self.header['num_samples_per_data_block']
+        for start in range(0, dat.num_samples, samples_per_read):
+            end = min(start + samples_per_read, dat.num_samples)
+            data = {'t_amplifier': np.array(dat.timestamps[start:end])}
+            if signal_types is None or 'amplifier' in signal_types:
+                # int16 counts back to the offset-binary words of an .rhd file.
+                counts = np.ascontiguousarray(dat.amplifier_data[amplifier_channels, start:end])
+                data['amplifier_data'] = np.bitwise_xor(counts.view(np.uint16), 0x8000)
+            if (signal_types is None or 'aux_input' in signal_types) and dat.aux_input_raw is not None:
+                data['aux_input_data'] = np.array(dat.aux_input_raw[:, start // 4:end // 4])
+            for key in ['board_dig_in', 'board_dig_out']:
+                if (signal_types is None or key in signal_types) and getattr(dat, key+'_raw') is not None:
+                    data[key+'_raw'] = np.array(getattr(dat, key+'_raw')[start:end])
+            yield data
+
+    def close(self):
+        if self.fid is not None:
+            self.fid.close()
+        if self.dat is not None:
+            self.dat.close()
+
+def scale_amplifier_data(result, sample_rate, dtype=None):
+    """Materializes raw amplifier counts from read_data(..., raw=True) in mV.
+
+    Returns a new dtype array (float32 by default) and applies the software
+    notch filter if the recording asked for it.
+    """
+
+    if dtype is None:
+        dtype = np.float32
+    amplifier_data = result['amplifier_data'].astype(dtype)
+    if result['amplifier_offset']:
+        amplifier_data -= result['amplifier_offset']
+    amplifier_data *= dtype(result['amplifier_scale'])
+
+    # Filter a few channels at a time so the float64 work arrays stay small.
+    if result['amplifier_notch_frequency'] > 0:
+        for i in range(0, amplifier_data.shape[0], 16):
+            amplifier_data[i:i+16,:] = notch_filter_chunk(amplifier_data[i:i+16,:], sample_rate, result['amplifier_notch_frequency'], 10)[0]
+
+    return amplifier_data
+
+def select_amplifier_channels(header, amplifier_channels):
+    """Returns a copy of header describing only the given amplifier channels.
+
+    amplifier_channels are indices into header['amplifier_channels'].
+    """
+
+    header = dict(header)
+    header['amplifier_channels'] = [header['amplifier_channels'][i] for i in amplifier_channels]
+    header['spike_triggers'] = [header['spike_triggers'][i] for i in amplifier_channels]
+    header['num_amplifier_channels'] = len(header['amplifier_channels'])
+    return header
+
 def plural(n):
     """Utility function to optionally pluralize words based on the value of n.
     """
@@ -0,0 +1,227 @@
+#! /bin/env python
+#
+# Incremental .nex / .nex5 writer for continuous channels that arrive in time chunks.
+
+import os, json, struct
+import numpy as np
+
+from NexFileHeaders import NexFileHeader, NexVarHeader, Nex5FileHeader, Nex5VarHeader
+from NexFileData import CalcScaleFloatsToShorts
+from NexFileWriters import NexFileVarType
+
+def float_to_short_scales(minimums, maximums):
+    """Per-channel .nex scales from the minimum and maximum float32 value of every channel.
+
+    Gives the same coefficients NexFileWriter computes from the full channel
+    values with CalcScaleFloatsToShorts.
+    """
+    return [CalcScaleFloatsToShorts(np.array([lo, hi], dtype=np.float32)) for lo, hi in zip(minimums, maximums)]
+
+class NexStreamWriter:
+    """Writes a .nex or .nex5 file whose continuous channels are filled in time chunks.
+
+    fd holds the events and intervals of the file; they are written up front
+    together with all headers.  The continuous channels (names) follow them
+    and share the sampling rate, the fragments and the number of points.
+    write() then takes the next samples of every channel (channels x samples)
+    and puts each row in place, so only one chunk is ever in memory.  .nex
+    files store 16-bit values, so their per-channel scales (see
+    float_to_short_scales) must be known before writing.  The file is the
+    same, byte for byte, as NexFileWriter / Nex5FileWriter write for a
+    FileData holding all the values.
+    """
+
+    def __init__(self, fd, filePath, names, samplingRate, fragmentTimestamps, fragmentStartIndexes, numPoints, nex5=True, scales=None):
+        if len(fd.Neurons) or len(fd.Markers) or len(fd.Continuous) or len(fd.Waveforms):
+            raise Exception('NexStreamWriter only writes events, intervals and streamed continuous channels.')
+        if not nex5 and scales is None:
+            raise Exception('Channel scales are needed to write a .nex file.')
+
+        self.fd = fd
+        self.nex5 = nex5
+        self.scales = scales
+        self.numChannels = len(names)
+        self.numPoints = numPoints
+        self.written = 0
+        self.fragmentTimestamps = np.asarray(fragmentTimestamps).astype(np.float64)
+        self.fragmentStartIndexes = np.asarray(fragmentStartIndexes).astype(np.uint32)
+
+        # Last timestamp of the continuous channels, as Continuous.MaxTimestamp computes it.
+        maxTs = fd.MaxTimestamp()
+        if len(names) and len(self.fragmentTimestamps) and samplingRate > 0 and len(self.fragmentStartIndexes) and numPoints:
+            step = 1.0/samplingRate
+            maxTs = max(maxTs, self.fragmentTimestamps[-1] + step * (numPoints - self.fragmentStartIndexes[-1] - 1.0))
+
+        self.file = open(filePath, "wb")
+        if nex5:
+            self.WriteNex5Headers(names, samplingRate, maxTs)
+        else:
+            self.WriteNexHeaders(names, samplingRate, maxTs)
+
+    def WriteNexHeaders(self, names, samplingRate, maxTs):
+        fd = self.fd
+        file = self.file
+        fh = NexFileHeader()
+        fh.TimestampFrequency = fd.TimestampFrequency
+        fh.Comment = fd.Comment
+        fh.Beg = fd.SecondsToTicks(fd.StartTimeSeconds)
+        fh.End = fd.SecondsToTicks(maxTs)
+        if fh.Beg > 2147483647 or fh.End > 2147483647:
+            raise ValueError("Unable to save data in .nex file: maximum timestamp exceeds 2^31")
+        numVars = fd.NumberOfVariables() + len(names)
+        fh.NumVars = numVars
+        fh.WriteToFile(file)
+
+        BytesInNexFileHeader = 544
+        BytesInNexVariableHeader = 208
+        dataPos = BytesInNexFileHeader + numVars * BytesInNexVariableHeader
+
+        for var in fd.Events:
+            vh = NexVarHeader()
+            vh.Type = NexFileVarType.EVENT
+            vh.Name = var.Name
+            vh.Count = len(var.Timestamps)
+            vh.DataOffset = dataPos
+            vh.WriteToFile(file)
+            dataPos += 4 * vh.Count
+
+        for var in fd.Intervals:
+            vh = NexVarHeader()
+            vh.Type = NexFileVarType.INTERVAL
+            vh.Name = var.Name
+            vh.Count = len(var.IntervalStarts)
+            vh.DataOffset = dataPos
+            vh.WriteToFile(file)
+            dataPos += 8 * vh.Count
+
+        self.valuePositions = []
+        for name, scale in zip(names, self.scales):
+            vh = NexVarHeader()
+            vh.Type = NexFileVarType.CONTINUOUS
+            vh.Name = name
+            vh.WFrequency = samplingRate
+            vh.Count = len(self.fragmentTimestamps)
+            vh.NPointsWave = self.numPoints
+            vh.ADtoMV = 1.0 / scale
+            vh.DataOffset = dataPos
+            vh.WriteToFile(file)
+            self.valuePositions.append(dataPos + 8 * vh.Count)
+            dataPos += 8 * vh.Count + vh.NPointsWave * 2
+
+        if dataPos > 4294967295:
+            self.file.close()
+            raise ValueError("Unable to save data in .nex file: file size exceeds 2^32")
+        self.endPosition = dataPos
+
+        for var in fd.Events:
+            np.around(var.Timestamps * fd.TimestampFrequency).astype(np.int32).tofile(file)
+
+        for var in fd.Intervals:
+            np.around(var.IntervalStarts * fd.TimestampFrequency).astype(np.int32).tofile(file)
+            np.around(var.IntervalEnds * fd.TimestampFrequency).astype(np.int32).tofile(file)
+
+        for pos in self.valuePositions:
+            file.seek(pos - 8 * len(self.fragmentTimestamps))
+            np.around(self.fragmentTimestamps * fd.TimestampFrequency).astype(np.int32).tofile(file)
+            self.fragmentStartIndexes.astype(np.int32).tofile(file)
+
+    def WriteNex5Headers(self, names, samplingRate, maxTs):
+        fd = self.fd
+        file = self.file
+        numVars = fd.NumberOfVariables() + len(names)
+        fh = Nex5FileHeader()
+        fh.Nex5FileVersion = 502
+        fh.Comment = fd.Comment
+        fh.TimestampFrequency = fd.TimestampFrequency
+        fh.RecordingStartTimeInTicks = fd.SecondsToTicks(fd.StartTimeSeconds)
+        fh.NumberOfVariables = numVars
+        fh.MetadataOffset = 0
+        fh.RecordingEndTimeInTicks = fd.SecondsToTicks(maxTs)
+        fh.WriteToFile(file)
+
+        BytesInNex5FileHeader = 356
+        BytesInNex5VariableHeader = 244
+        dataPos = BytesInNex5FileHeader + numVars * BytesInNex5VariableHeader
+
+        for var in fd.Events:
+            vh = Nex5VarHeader()
+            vh.Type = NexFileVarType.EVENT
+            vh.Name = var.Name
+            vh.Count = len(var.Timestamps)
+            vh.DataOffset = dataPos
+            vh.TimestampDataType = 1
+            vh.WriteToFile(file)
+            dataPos += 8 * vh.Count
+
+        for var in fd.Intervals:
+            vh = Nex5VarHeader()
+            vh.Type = NexFileVarType.INTERVAL
+            vh.Name = var.Name
+            vh.Count = len(var.IntervalStarts)
+            vh.TimestampDataType = 1
+            vh.DataOffset = dataPos
+            vh.WriteToFile(file)
+            dataPos += 16 * vh.Count
+
+        self.valuePositions = []
+        for name in names:
+            vh = Nex5VarHeader()
+            vh.Type = NexFileVarType.CONTINUOUS
+            vh.Name = name
+            vh.SamplingFrequency = samplingRate
+            vh.TimestampDataType = 1
+            vh.ContinuousDataType = 1
+            vh.Count = len(self.fragmentTimestamps)
+            vh.NumberOfDataPoints = self.numPoints
+            vh.ADtoUnitsCoefficient = 1.0
+            vh.DataOffset = dataPos
+            vh.WriteToFile(file)
+            self.valuePositions.append(dataPos + (8 + 4) * vh.Count)
+            dataPos += (8 + 4) * vh.Count + vh.NumberOfDataPoints * 4
+        self.endPosition = dataPos
+
+        for var in fd.Events:
+            np.around(var.Timestamps * fd.TimestampFrequency).astype(np.int64).tofile(file)
+
+        for var in fd.Intervals:
+            np.around(var.IntervalStarts * fd.TimestampFrequency).astype(np.int64).tofile(file)
+            np.around(var.IntervalEnds * fd.TimestampFrequency).astype(np.int64).tofile(file)
+
+        for pos in self.valuePositions:
+            file.seek(pos - (8 + 4) * len(self.fragmentTimestamps))
+            np.around(self.fragmentTimestamps * fd.TimestampFrequency).astype(np.int64).tofile(file)
+            self.fragmentStartIndexes.astype(np.uint32).tofile(file)
+
+    def write(self, chunk):
+        """Appends chunk (channels x samples) to the continuous channels."""
+        if chunk.shape[0] != self.numChannels:
+            raise Exception('Expected {0} channels, got {1}.'.format(self.numChannels, chunk.shape[0]))
+        if self.written + chunk.shape[1] > self.numPoints:
+            raise Exception('More samples written than announced in the file header.')
+        itemsize = 4 if self.nex5 else 2
+        for i in range(self.numChannels):
+            values = chunk[i].astype(np.float32)
+            self.file.seek(self.valuePositions[i] + self.written * itemsize)
+            if self.nex5:
+                values.tofile(self.file)
+            else:
+                np.around(values * self.scales[i]).astype(np.int16).tofile(self.file)
+        self.written += chunk.shape[1]
+
+    def discard(self):
+        """Closes and deletes the unfinished file, e.g. when the conversion is cancelled."""
+        self.file.close()
+        os.remove(self.file.name)
+
+    def close(self):
+        if self.written != self.numPoints:
+            self.file.close()
+            raise Exception('{0} of {1} samples written.'.format(self.written, self.numPoints))
+        if self.nex5:
+            # write metadata
+            self.file.seek(self.endPosition)
+            jsonString = json.dumps({'variables': []})
+            self.file.write(jsonString.encode())
+            self.file.seek(284)
+            self.file.write(struct.pack('<q', self.endPosition))
+        self.file.close()
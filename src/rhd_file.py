@@ -0,0 +1,185 @@
+#! /bin/env python
+#
+# Lazy, memory-mapped access to Intan RHD2000 data files.
+
+import os
+import numpy as np
+
+from intanutil.read_header import read_header
+from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
+from intanutil.get_data_block_dtype import get_data_block_dtype
+
+
+def decode_block_samples(field, samples_per_block, t_key, num_samples, ch_key=None):
+    """Decodes samples t_key (and channels ch_key) of a per-block field.
+
+    field has shape (blocks, samples) or (blocks, channels, samples); only the
+    blocks that cover the requested samples are touched.  The result has the
+    sample axis last, like the arrays returned by read_data.
+    """
+
+    if isinstance(t_key, slice):
+        t_range = range(*t_key.indices(num_samples))
+    else:
+        t = int(t_key)
+        if t < 0:
+            t += num_samples
+        if t < 0 or t >= num_samples:
+            raise IndexError('Sample index out of range.')
+        t_range = range(t, t + 1)
+
+    if len(t_range) == 0:
+        first_block, last_block = 0, 0
+    else:
+        first_block = min(t_range[0], t_range[-1]) // samples_per_block
+        last_block = max(t_range[0], t_range[-1]) // samples_per_block + 1
+
+    raw = field[first_block:last_block]
+    if ch_key is not None:
+        raw = raw[:, ch_key]
+    if raw.ndim == 2:
+        raw = raw.reshape(-1)
+    else:
+        raw = raw.transpose(1, 0, 2).reshape(raw.shape[1], -1)
+
+    local = np.asarray(t_range, dtype=np.int64) - first_block * samples_per_block
+    if t_range.step == 1 and len(t_range) > 0:
+        raw = raw[..., local[0]:local[-1] + 1]
+    else:
+        raw = raw[..., local]
+    if not isinstance(t_key, slice):
+        raw = raw[..., 0]
+    return raw
+
+
+class RhdSignal:
+    """Lazy 2-D view (channels x samples) of one signal type in an RhdFile.
+
+    Indexing with [ch_slice, t_slice] decodes only the data blocks that cover
+    the requested samples and returns a new numpy array.  Channel indices may
+    be ints, slices or lists; time indices may be ints or slices.
+    """
+
+    def __init__(self, rhd_file, field, num_channels, samples_per_block, scale, offset):
+        self._file = rhd_file
+        self._field = field
+        self._samples_per_block = samples_per_block
+        self._scale = scale
+        self._offset = offset
+        self.shape = (num_channels, samples_per_block * rhd_file.num_data_blocks)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        ch_key, t_key = key
+        if self.shape[0] == 0:
+            field = np.zeros((self._file.num_data_blocks, 0, self._samples_per_block), dtype=np.uint16)
+        else:
+            field = self._file.blocks[self._field]
+        raw = decode_block_samples(field, self._samples_per_block, t_key, self.shape[1], ch_key)
+        return np.multiply(self._scale, (raw.astype(np.int32) - self._offset))
+
+
+class RhdTimestamps:
+    """Lazy 1-D view of the amplifier timestamps of an RhdFile, in seconds."""
+
+    def __init__(self, rhd_file):
+        self._file = rhd_file
+        self.shape = (rhd_file.num_samples,)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, t_key):
+        raw = decode_block_samples(self._file.blocks['timestamps'], self._file.header['num_samples_per_data_block'],
+                                   t_key, self.shape[0])
+        return raw / self._file.sample_rate
+
+
+class RhdFile:
+    """Memory-mapped Intan RHD2000 data file.
+
+    The header is parsed with read_header and the data region is memory
+    mapped as an array of data blocks, so opening a file costs almost nothing
+    and samples are decoded only when a slice of amplifier_data,
+    aux_input_data, board_adc_data or t_amplifier is requested.  Scaling
+    matches read_data; the software notch filter is not applied.
+
+    Example:
+        with RhdFile('rec_210101_120000.rhd') as f:
+            window = f.amplifier_data[0:4, 0:int(10 * f.sample_rate)]
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fid:
+            self.header = read_header(fid)
+            self.data_offset = fid.tell()
+        filesize = os.path.getsize(filename)
+
+        self.bytes_per_block = int(get_bytes_per_data_block(self.header))
+        bytes_remaining = filesize - self.data_offset
+        if bytes_remaining % self.bytes_per_block != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+        self.num_data_blocks = bytes_remaining // self.bytes_per_block
+
+        self.block_dtype = get_data_block_dtype(self.header)
+        if self.num_data_blocks > 0:
+            self.blocks = np.memmap(filename, dtype=self.block_dtype, mode='r',
+                                    offset=self.data_offset, shape=(self.num_data_blocks,))
+        else:
+            self.blocks = np.zeros(0, dtype=self.block_dtype)
+
+        header = self.header
+        spb = header['num_samples_per_data_block']
+        self.sample_rate = header['sample_rate']
+        self.num_samples = spb * self.num_data_blocks
+        self.record_time = self.num_samples / self.sample_rate
+
+        self.t_amplifier = RhdTimestamps(self)
+        self.amplifier_data = RhdSignal(self, 'amplifier', header['num_amplifier_channels'], spb, 0.000195, 32768)      # units = mV
+        self.aux_input_data = RhdSignal(self, 'aux_input', header['num_aux_input_channels'], int(spb / 4), 37.4e-6, 0)  # units = volts
+        if header['eval_board_mode'] == 1:
+            adc_scale, adc_offset = 152.59e-6, 32768
+        elif header['eval_board_mode'] == 13:
+            adc_scale, adc_offset = 312.5e-6, 32768
+        else:
+            adc_scale, adc_offset = 50.354e-6, 0
+        self.board_adc_data = RhdSignal(self, 'board_adc', header['num_board_adc_channels'], spb, adc_scale, adc_offset)  # units = volts
+
+    def time_slices(self, start_time, end_time):
+        """Sample slices holding the samples timed in [start_time, end_time) seconds.
+
+        The blocks are found through the sidecar index (see rhd_index), and
+        only their timestamps are read, so the window costs no more than the
+        data it holds.  Where timestamps jump back, the window may match
+        several parts of the file, hence a list.  Use as
+            for s in f.time_slices(10, 20):
+                window = f.amplifier_data[:, s]
+        """
+        from intanutil.rhd_index import load_index, find_blocks
+        spb = self.header['num_samples_per_data_block']
+        index = load_index(self.filename)
+        start = int(np.floor(start_time * self.sample_rate))
+        end = int(np.ceil(end_time * self.sample_rate)) + 1
+        slices = []
+        for offset, first_block, num_blocks in find_blocks(index, start, end):
+            t = self.blocks['timestamps'][first_block:first_block + num_blocks].reshape(-1) / self.sample_rate
+            inside = np.concatenate(([False], (t >= start_time) & (t < end_time), [False]))
+            edges = np.flatnonzero(np.diff(inside.astype(np.int8)))
+            for run_start, run_end in zip(edges[::2], edges[1::2]):
+                slices.append(slice(first_block * spb + int(run_start), first_block * spb + int(run_end)))
+        return slices
+
+    def close(self):
+        """Drops the memory map.  Arrays already returned stay valid."""
+        self.blocks = np.zeros(0, dtype=self.block_dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
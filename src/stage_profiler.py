@@ -0,0 +1,114 @@
+#! /bin/env python
+#
+# Wall time, CPU time, data sizes and peak memory of the stages of a conversion.
+
+import sys, os, time, json
+import tracemalloc
+from contextlib import contextmanager
+
+def peak_rss():
+    """Peak resident memory of this process since it started, in bytes (None if unknown).
+
+    This is a lifetime high-water mark: it never goes down, and it covers
+    whatever the process did before, e.g. earlier sessions in a reused
+    worker process.
+    """
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+        get_current_process.restype = wintypes.HANDLE
+        get_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+        if not get_memory_info(get_current_process(), ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+NOTES = {
+    'process_peak_rss_so_far_bytes': 'Highest resident memory of the process since it started, when the stage ended; '
+                                     'not a peak of the stage alone, and it includes earlier work of a reused process.',
+    'peak_traced_bytes': 'Peak memory allocated by Python and numpy during the stage alone (tracemalloc).',
+}
+
+class StageProfiler:
+    """Measures the stages of one conversion and writes them as a JSON report.
+
+        with profiler.stage('decode_rhds', bytes_in=n) as stage:
+            ...
+            stage['bytes_out'] = m
+
+    Every stage records its wall and CPU time (of this process, and of the
+    worker processes that ended during the stage where the OS reports
+    them), the bytes it took in and gave out and the peak RSS of the process
+    so far (process_peak_rss_so_far_bytes: not a peak of the stage alone, so
+    a stage after a heavier one shows the same value).  With trace_memory,
+    the peak memory allocated by Python and numpy during the stage is
+    recorded too (tracemalloc); this slows down stages that create many
+    Python objects, such as save_nex, many times.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.stages = []
+        self.started = time.strftime('%Y-%m-%d %X', time.localtime())
+        self.trace_memory = trace_memory and not tracemalloc.is_tracing()
+        if self.trace_memory:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, bytes_in=0):
+        record = {'name': name, 'bytes_in': int(bytes_in), 'bytes_out': 0}
+        self.stages.append(record)
+        start = time.perf_counter()
+        times = os.times()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            end = os.times()
+            record['wall_seconds'] = round(time.perf_counter() - start, 4)
+            record['cpu_seconds'] = round(end.user - times.user + end.system - times.system, 4)
+            record['child_cpu_seconds'] = round(end.children_user - times.children_user + end.children_system - times.children_system, 4)
+            record['process_peak_rss_so_far_bytes'] = peak_rss()
+            if self.trace_memory:
+                record['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+
+    def report(self, **fields):
+        """The report as a dict: fields, then the stages and their totals."""
+        report = dict(fields)
+        report['started'] = self.started
+        report['stages'] = self.stages
+        report['total'] = {key: round(sum(stage.get(key, 0) for stage in self.stages), 4)
+                           for key in ['wall_seconds', 'cpu_seconds', 'child_cpu_seconds']}
+        report['total']['process_peak_rss_so_far_bytes'] = peak_rss()
+        report['notes'] = NOTES
+        return report
+
+    def save(self, filename, **fields):
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.report(**fields), f, indent=4, ensure_ascii=False)
+
+    def close(self):
+        if self.trace_memory:
+            tracemalloc.stop()
+            self.trace_memory = False
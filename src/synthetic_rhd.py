@@ -0,0 +1,230 @@
+#! /bin/env python
+#
+# Writes synthetic Intan RHD2000 data files, for tests and benchmarks.
+#
+#   python synthetic_rhd.py D:\data\synthetic -n 3 -d 60 -c 64
+#
+# The files follow the format read by read_header / read_data: amplifier
+# noise with spikes and an optional line hum, aux inputs, supply voltage,
+# temperature sensors, board ADC sine waves and digital pulse trains, with
+# timestamp gaps where asked.
+
+import sys, os, struct, io
+import argparse
+from time import localtime, mktime, strftime
+
+import numpy as np
+
+from intanutil.read_header import read_header
+from intanutil.get_data_block_dtype import get_data_block_dtype
+
+SPIKE_WAVEFORM = np.array([0, -0.1, -0.35, -0.75, -1, -0.8, -0.35, 0.05, 0.3, 0.42, 0.45, 0.42, 0.36, 0.29, 0.22,
+                           0.16, 0.11, 0.07, 0.04, 0.02, 0.01, 0])     # at 30 kHz, 1 = amplitude
+
+def qstring(s):
+    """Qt style QString: the length in bytes, then the UTF-16 text."""
+    if s is None:
+        return struct.pack('<I', 0xffffffff)
+    data = s.encode('utf-16-le')
+    return struct.pack('<I', len(data)) + data
+
+def channel_record(native_name, order, signal_type, impedance=0.0):
+    return (qstring(native_name) + qstring(native_name) + struct.pack('<hhhhhh', order, order, signal_type, 1, order, 0)
+            + struct.pack('<hhhh', 0, 0, 0, 0) + struct.pack('<ff', impedance, -30.0))
+
+def make_header(num_channels=32, sample_rate=30000.0, num_aux=3, num_supply=1, num_temp=0, num_adc=0, num_dig_in=0,
+                num_dig_out=0, notch=0, version=(3, 0), impedances=None, note=''):
+    """Header bytes of an RHD file with channels on Port A and the board ADC/digital channels.
+
+    notch is 0, 50 or 60 (Hz); readers only apply the software notch to
+    files of version 1.x and 2.x.  impedances are the electrode impedance
+    magnitudes of the amplifier channels, in ohms.
+    """
+    major, minor = version
+    if notch not in (0, 50, 60):
+        raise Exception('notch must be 0, 50 or 60')
+    if impedances is None:
+        impedances = [1e6] * num_channels
+    if len(impedances) != num_channels:
+        raise Exception('One impedance per amplifier channel is needed')
+    h = struct.pack('<I', 0xc6912702) + struct.pack('<hh', major, minor) + struct.pack('<f', sample_rate)
+    h += struct.pack('<hffffff', 1, 1.0, 0.1, 7500.0, 1.0, 0.1, 7500.0)
+    h += struct.pack('<h', {0: 0, 50: 1, 60: 2}[notch]) + struct.pack('<ff', 1000.0, 1000.0)
+    h += qstring(note) + qstring(None) + qstring(None)
+    if (major == 1 and minor >= 1) or major > 1:
+        h += struct.pack('<h', num_temp)
+    if (major == 1 and minor >= 3) or major > 1:
+        h += struct.pack('<h', 0)
+    if major > 1:
+        h += qstring('Hardware')
+
+    port = [channel_record('A-%03d' % i, i, 0, impedances[i]) for i in range(num_channels)]
+    port += [channel_record('A-AUX%d' % (i+1), i, 1) for i in range(num_aux)]
+    port += [channel_record('A-VDD%d' % (i+1), i, 2) for i in range(num_supply)]
+    groups = [('Port A', 'A', port, num_channels),
+              ('Board ADC Inputs', 'ADC', [channel_record('ADC-%02d' % i, i, 3) for i in range(num_adc)], 0),
+              ('Board Digital Inputs', 'DIN', [channel_record('DIN-%02d' % i, i, 4) for i in range(num_dig_in)], 0),
+              ('Board Digital Outputs', 'DOUT', [channel_record('DOUT-%02d' % i, i, 5) for i in range(num_dig_out)], 0)]
+    h += struct.pack('<h', len(groups))
+    for name, prefix, records, num_amp in groups:
+        h += qstring(name) + qstring(prefix) + struct.pack('<hhh', 1, len(records), num_amp)
+        h += b''.join(records)
+    return h
+
+def spike_train(rng, num_samples, sample_rate, rate):
+    """Sorted sample indexes of a Poisson spike train of rate Hz, at least 2 ms apart."""
+    count = rng.poisson(rate * num_samples / sample_rate)
+    spikes = np.unique(rng.integers(0, num_samples, count))
+    if len(spikes) > 1:
+        spikes = spikes[np.concatenate(([True], np.diff(spikes) >= int(0.002 * sample_rate)))]
+    return spikes
+
+def write_rhd(filename, num_blocks=1000, num_channels=32, sample_rate=30000.0, num_aux=3, num_supply=1, num_temp=0,
+              num_adc=0, num_dig_in=0, num_dig_out=0, notch=0, version=(3, 0), gaps=(), gap_samples=3000,
+              spike_rate=5.0, spike_amplitude=100.0, noise=10.0, hum=0.0, impedances=None, first_timestamp=0, seed=0,
+              blocks_per_write=256):
+    """Writes an RHD file of num_blocks data blocks and returns what it contains.
+
+    Amplifier channels carry gaussian noise of noise uV, spikes of
+    spike_amplitude uV at spike_rate Hz and, with hum, a sine of hum uV at the
+    notch frequency (or 50 Hz) common to all channels.  Timestamps start at
+    first_timestamp and jump by gap_samples before every block listed in gaps.
+    Data are written blocks_per_write blocks at a time, so files of any size
+    take little memory.
+
+    Returns a dict with 'num_samples', 'last_timestamp' and 'spikes' (the
+    sample indexes of the spikes, one array per channel).
+    """
+    rng = np.random.default_rng(seed)
+    if impedances is None:
+        impedances = rng.uniform(0.3e6, 1.2e6, num_channels).tolist()
+    header_bytes = make_header(num_channels, sample_rate, num_aux, num_supply, num_temp, num_adc, num_dig_in, num_dig_out,
+                               notch, version, impedances, note='synthetic seed=%d' % seed)
+    header = read_header(io.BytesIO(header_bytes))
+    block_dtype = get_data_block_dtype(header)
+    spb = header['num_samples_per_data_block']
+    num_samples = num_blocks * spb
+    gaps = set(gaps)
+
+    # Spikes of every channel, placed once for the whole file.
+    waveform = np.interp(np.arange(int(len(SPIKE_WAVEFORM) * sample_rate / 30000)) * 30000 / sample_rate,
+                         np.arange(len(SPIKE_WAVEFORM)), SPIKE_WAVEFORM) * spike_amplitude
+    spikes = [spike_train(rng, num_samples, sample_rate, spike_rate) for c in range(num_channels)]
+    hum_frequency = notch or 50
+
+    timestamp = first_timestamp
+    with open(filename, 'wb') as f:
+        f.write(header_bytes)
+        for first in range(0, num_blocks, blocks_per_write):
+            count = min(blocks_per_write, num_blocks - first)
+            start = first * spb
+            n = count * spb
+            blocks = np.zeros(count, dtype=block_dtype)
+
+            steps = np.ones(n, dtype=np.int64)
+            steps[0] = 0
+            for b in gaps:
+                if first < b < first + count:
+                    steps[(b - first) * spb] += gap_samples
+            timestamps = timestamp + np.cumsum(steps)
+            if first in gaps and first > 0:
+                timestamps += gap_samples
+            timestamp = timestamps[-1] + 1
+            blocks['timestamps'] = timestamps.reshape(count, spb)
+            t = np.arange(start, start + n) / sample_rate
+
+            if num_channels:
+                uv = rng.normal(0, noise, (num_channels, n)).astype(np.float32)
+                if hum:
+                    uv += (hum * np.sin(2 * np.pi * hum_frequency * t)).astype(np.float32)
+                for c in range(num_channels):
+                    s = spikes[c][(spikes[c] > start - len(waveform)) & (spikes[c] < start + n)] - start
+                    index = (s[:, None] + np.arange(len(waveform))).ravel()
+                    values = np.tile(waveform, len(s))
+                    keep = (index >= 0) & (index < n)
+                    np.add.at(uv[c], index[keep], values[keep])
+                counts = np.clip(np.round(uv / 0.195) + 32768, 0, 65535).astype(np.uint16)
+                blocks['amplifier'] = counts.reshape(num_channels, count, spb).transpose(1, 0, 2)
+            if num_aux:
+                # Accelerometer at rest: about 1.2 V with a little noise.
+                aux = rng.normal(1.2 / 37.4e-6, 200, (count, num_aux, spb // 4))
+                blocks['aux_input'] = np.clip(np.round(aux), 0, 65535).astype(np.uint16)
+            if num_supply:
+                blocks['supply_voltage'] = int(3.3 / 74.8e-6)
+            if num_temp:
+                blocks['temp_sensor'] = 2500         # 25 degrees C
+            if num_adc:
+                volts = 1.65 + 1.5 * np.sin(2 * np.pi * (np.arange(num_adc)[:, None] + 1) * t)
+                adc = np.clip(np.round(volts / 50.354e-6), 0, 65535).astype(np.uint16)
+                blocks['board_adc'] = adc.reshape(num_adc, count, spb).transpose(1, 0, 2)
+            # Digital channel i is a pulse train of period 1/(i+1) s; outputs
+            # run twice as slow.
+            for field, num_dig, period in [('board_dig_in', num_dig_in, 1.0), ('board_dig_out', num_dig_out, 2.0)]:
+                if num_dig:
+                    words = np.zeros(n, dtype=np.uint16)
+                    for i in range(num_dig):
+                        high = (np.floor(t * (i + 1) * 2 / period) % 2).astype(np.uint16)
+                        words |= high << i
+                    blocks[field] = words.reshape(count, spb)
+            f.write(blocks.tobytes())
+    return {'num_samples': num_samples, 'last_timestamp': int(timestamp - 1), 'spikes': spikes}
+
+def write_session(folder, num_files=3, duration=60, prefix='synthetic', start_time=None, **kwargs):
+    """Writes a continuous recording of num_files files of duration seconds each into folder.
+
+    The files are named <prefix>_YYMMDD_HHMMSS.rhd, duration seconds apart,
+    as the Intan software names them, and their timestamps run on from one
+    file to the next.  Other arguments go to write_rhd; gaps (block
+    indexes) apply to every file.  Returns the file paths.
+    """
+    sample_rate = kwargs.get('sample_rate', 30000.0)
+    spb = 128 if kwargs.get('version', (3, 0))[0] > 1 else 60
+    num_blocks = int(round(duration * sample_rate / spb))
+    if start_time is None:
+        start_time = mktime((2021, 1, 1, 12, 0, 0, 0, 0, -1))
+    seed = kwargs.pop('seed', 0)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    timestamp = kwargs.pop('first_timestamp', 0)
+    for i in range(num_files):
+        name = prefix + strftime('_%y%m%d_%H%M%S.rhd', localtime(start_time + i * duration))
+        path = os.path.join(folder, name)
+        result = write_rhd(path, num_blocks, first_timestamp=timestamp, seed=seed + i, **kwargs)
+        timestamp = result['last_timestamp'] + 1
+        paths.append(path)
+    return paths
+
+def parse_version(text):
+    major, minor = text.split('.')
+    return int(major), int(minor)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Writes a synthetic rhd recording (one or more files) into a folder.')
+    parser.add_argument('folder', help='output folder')
+    parser.add_argument('-n', '--files', type=int, default=1, help='number of files (default: %(default)s)')
+    parser.add_argument('-d', '--duration', type=int, default=60, help='seconds per file (default: %(default)s)')
+    parser.add_argument('-c', '--channels', type=int, default=32, help='amplifier channels (default: %(default)s)')
+    parser.add_argument('-r', '--sample-rate', type=float, default=30000.0, help='Hz (default: %(default)s)')
+    parser.add_argument('--aux', type=int, default=3, help='aux input channels (default: %(default)s)')
+    parser.add_argument('--adc', type=int, default=0, help='board ADC channels (default: %(default)s)')
+    parser.add_argument('--dig-in', type=int, default=0, help='digital input channels (default: %(default)s)')
+    parser.add_argument('--dig-out', type=int, default=0, help='digital output channels (default: %(default)s)')
+    parser.add_argument('--notch', type=int, default=0, choices=[0, 50, 60], help='software notch filter setting (default: %(default)s)')
+    parser.add_argument('--hum', type=float, default=0.0, help='line hum amplitude in uV (default: %(default)s)')
+    parser.add_argument('--version', type=parse_version, default=(3, 0), help='file format version (default: 3.0)')
+    parser.add_argument('--gaps', type=int, nargs='*', default=[], help='block indexes before which the timestamps jump')
+    parser.add_argument('--spike-rate', type=float, default=5.0, help='spikes per second per channel (default: %(default)s)')
+    parser.add_argument('--prefix', default='synthetic', help='file name prefix (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    paths = write_session(args.folder, args.files, args.duration, args.prefix, num_channels=args.channels,
+                          sample_rate=args.sample_rate, num_aux=args.aux, num_adc=args.adc, num_dig_in=args.dig_in,
+                          num_dig_out=args.dig_out, notch=args.notch, hum=args.hum, version=args.version, gaps=args.gaps,
+                          spike_rate=args.spike_rate, seed=args.seed)
+    for path in paths:
+        print(path)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+#! /bin/env python
+#
+# Smoke test of the batch CLI on synthetic sessions.
+
+import sys, os, csv, subprocess, tempfile, shutil
+import unittest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from converter_core import Config
+from synthetic_rhd import write_session
+
+class BatchConvertTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='batch_convert_test_')
+        self.sessions = []
+        for i in range(2):
+            folder = os.path.join(self.tmp, 'session%d' % i)
+            write_session(folder, 2, 2, num_channels=8, num_dig_in=2, gaps=[50], seed=i)
+            self.sessions.append(folder)
+        self.config = os.path.join(self.tmp, 'config.json')
+        Config(ref_en=1, gen_ofb_en=1).save(self.config)
+        self.summary = os.path.join(self.tmp, 'batch_summary.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def run_cli(self, *args):
+        return subprocess.run([sys.executable, 'batch_convert.py', '-c', self.config, '-j', '2', '--summary', self.summary] + list(args),
+                              cwd=SRC, capture_output=True, text=True, timeout=300)
+
+    def read_summary(self):
+        with open(self.summary, newline='', encoding='utf-8') as f:
+            return list(csv.DictReader(f))
+
+    def test_converts_sessions(self):
+        result = self.run_cli(*self.sessions)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        rows = self.read_summary()
+        self.assertEqual([row['session'] for row in rows], self.sessions)
+        for row in rows:
+            self.assertEqual(row['status'], 'ok', row['error'])
+            self.assertEqual(row['output'], os.path.join(row['session'], 'out.nex'))
+            self.assertGreater(os.path.getsize(row['output']), 0)
+            self.assertTrue(os.path.exists(os.path.join(row['session'], 'out_profile.json')))
+            self.assertTrue(os.path.exists(os.path.join(row['session'], 'out_pre.ofb')))
+
+    def test_failed_session(self):
+        empty = os.path.join(self.tmp, 'empty')
+        os.mkdir(empty)
+        result = self.run_cli(self.sessions[0], empty)
+        self.assertEqual(result.returncode, 1, result.stdout + result.stderr)
+        rows = self.read_summary()
+        self.assertEqual([row['status'] for row in rows], ['ok', 'failed'])
+        self.assertIn('rhd', rows[1]['error'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#! /bin/env python
+#
+# Tests of the PCA common reference on a shared low-rank artifact.
+
+import sys, os
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from common_reference import common_reference, estimate_components, reference_chunk
+
+class PcaReferenceTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.num_channels, num_samples = 16, 200000
+        t = np.arange(num_samples) / 30000.0
+        # Two shared sources (e.g. chewing and movement) with different weights on every channel.
+        sources = np.vstack((np.sin(2 * np.pi * 3 * t), np.sign(np.sin(2 * np.pi * 0.7 * t))))
+        self.artifact = rng.uniform(0.5, 2.0, (self.num_channels, 2)) @ sources
+        self.noise = 0.01 * rng.standard_normal((self.num_channels, num_samples))
+        # A signal on one channel only.
+        self.unshared = np.zeros((self.num_channels, num_samples))
+        self.unshared[5] = 0.2 * np.sin(2 * np.pi * 1000 * t)
+        self.offsets = rng.uniform(-50, 50, self.num_channels)
+        self.data = self.offsets[:, None] + self.artifact + self.noise + self.unshared
+
+    def test_removes_shared_artifact(self):
+        out = common_reference(self.data.copy(), mode='pca', num_components=2)
+        residual = out - self.noise - self.unshared
+        residual -= residual.mean(axis=1, keepdims=True)
+        # The artifact (of order 1) is gone, up to the part of the one-channel
+        # signal that lies along the components.
+        self.assertLess(np.abs(residual).max(), 0.1)
+        self.assertLess(np.sqrt(np.mean(residual ** 2)), 0.02 * self.artifact.std())
+        # The one-channel signal survives.
+        self.assertGreater(np.corrcoef(out[5], self.unshared[5])[0, 1], 0.99)
+        # Per-channel offsets are kept, not taken away with the components
+        # (up to the mean of the artifact itself).
+        np.testing.assert_allclose(out.mean(axis=1), self.offsets, atol=0.5)
+
+    def test_given_components(self):
+        chunk = reference_chunk(self.num_channels)
+        components = [estimate_components(self.data, slice(None), 2, chunk)]
+        expected = common_reference(self.data.copy(), mode='pca', num_components=2)
+        out = common_reference(self.data.copy(), mode='pca', components=components)
+        np.testing.assert_array_equal(out, expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#! /bin/env python
+#
+# Tests of motion detection on flat and quantized accelerometer data.
+
+import sys, os
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from intanutil.motion_detection import AUX_STEP, detect_motion, detect_motion_chunks
+
+SAMPLE_RATE = 7500.0
+
+def quantized_aux(seconds, seed=0, changes=0.001):
+    """Three aux channels at rest: a constant level with rare one-count steps, in volts."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLE_RATE)
+    counts = 32000 + (rng.random((3, n)) < changes) * rng.choice([-1, 1], (3, n))
+    return counts * AUX_STEP
+
+class MotionDetectionTest(unittest.TestCase):
+
+    def test_constant_input(self):
+        aux = np.full((3, int(60 * SAMPLE_RATE)), 1.2)
+        self.assertEqual(detect_motion(aux, SAMPLE_RATE), [])
+        self.assertEqual(detect_motion(np.zeros((3, int(60 * SAMPLE_RATE))), SAMPLE_RATE, min_spread=0), [])
+
+    def test_nearly_constant_input(self):
+        aux = quantized_aux(60)
+        self.assertEqual(detect_motion(aux, SAMPLE_RATE), [])
+        self.assertEqual(detect_motion_chunks(np.array_split(aux, 7, axis=1), SAMPLE_RATE), [])
+
+    def test_motion_over_quiet_input(self):
+        aux = quantized_aux(60, seed=1)
+        start, end = int(20 * SAMPLE_RATE), int(22 * SAMPLE_RATE)
+        aux[:, start:end] += 0.05 * np.random.default_rng(2).standard_normal((3, end - start))
+        periods = detect_motion(aux, SAMPLE_RATE)
+        self.assertEqual(len(periods), 1)
+        self.assertAlmostEqual(periods[0][0], 20.0, delta=0.5)
+        self.assertAlmostEqual(periods[0][1], 22.0, delta=0.5)
+        self.assertEqual(detect_motion_chunks(np.array_split(aux, 5, axis=1), SAMPLE_RATE), periods)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#! /bin/env python
+#
+# Checks that streaming conversion writes the same files as the in-memory path.
+
+import sys, os, filecmp, itertools, tempfile, shutil
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from converter_core import Config, convert
+from synthetic_rhd import write_session
+
+class StreamConvertTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp(prefix='stream_convert_test_')
+        cls.session = os.path.join(cls.tmp, 'session')
+        write_session(cls.session, 2, 3, num_channels=32, num_dig_in=2, num_dig_out=1, gaps=[50], hum=20.0)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def convert(self, name, **settings):
+        info = convert(self.session, Config(file_name=name, workers=1, **settings))
+        self.assertIsNotNone(info, name)
+        return info['nex_name']
+
+    def test_same_output(self):
+        # ref_mode 2 (pca) streams an extra pass to estimate the components.
+        for file_format, (ref_en, ref_mode), crop_mode in itertools.product((0, 1), ((0, 0), (1, 0), (1, 2)), (0, 1)):
+            settings = dict(file_format=file_format, ref_en=ref_en, ref_mode=ref_mode, crop_mode=crop_mode,
+                            delete_en=1, delete_string='(0.5,0.8);(4.5,5)')
+            name = 'out_%d_%d_%d_%d' % (file_format, ref_en, ref_mode, crop_mode)
+            with self.subTest(name=name):
+                expected = self.convert(name + '_memory', **settings)
+                # The smallest memory limit: blocks of one reference chunk
+                # (131072 samples of 32 channels), so the data stream in two.
+                actual = self.convert(name + '_stream', stream_en=1, memory_limit=1, **settings)
+                self.assertEqual(os.path.splitext(actual)[1], '.nex5' if file_format else '.nex')
+                self.assertTrue(filecmp.cmp(expected, actual, shallow=False), name)
+
+if __name__ == '__main__':
+    unittest.main()